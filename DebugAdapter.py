@@ -16,6 +16,10 @@ def get_adapter_for_current_system(**kwargs):
 	if system == 'Windows':
 		return dbgeng.DebugAdapterDbgeng(**kwargs)
 	elif system == 'Linux':
+		# opt-in: trace the process ourselves instead of through gdbserver
+		if kwargs.get('ptrace'):
+			from . import ptrace
+			return ptrace.DebugAdapterPtrace(**kwargs)
 		return gdb.DebugAdapterGdb(**kwargs)
 	elif system == 'Darwin':
 		return lldb.DebugAdapterLLDB(**kwargs)
@@ -62,12 +66,23 @@ class STOP_REASON(Enum):
 	SIGNAL_STKFLT = auto()
 	SIGNAL_BUX = auto()
 	SIGNAL_POLL = auto()
+	# data is the watched address that was hit
+	WATCHPOINT_WRITE = auto()
+	WATCHPOINT_READ = auto()
+	WATCHPOINT_ACCESS = auto()
 
 class DebugAdapter:
 	def __init__(self, **kwargs):
 		# stdout handling callback
 		self.cb_stdout = kwargs.get('stdout', None)
 
+		# address -> condition bytecode evaluated here, see condition_false_at_stop()
+		self.breakpoint_conditions = {}
+		# the dynamic linker's breakpoint, see library_breakpoint_set()
+		self.library_breakpoint = None
+		# libraries were loaded or unloaded since modules_changed()
+		self.modules_dirty = False
+
 	# session start/stop
 	def exec(self, path, args):
 		raise NotImplementedError('')
@@ -96,8 +111,8 @@ class DebugAdapter:
 		raise NotImplementedError('')
 
 	# breakpoints
-	def breakpoint_set(self, address):
-		''' set software breakpoint at address '''
+	def breakpoint_set(self, address, condition=None):
+		''' set software breakpoint at address, stopping only when condition holds (see agentexpr) '''
 		raise NotImplementedError('')
 	def breakpoint_clear(self, address):
 		''' delete breakpoint by address '''
@@ -105,6 +120,37 @@ class DebugAdapter:
 	def breakpoint_list(self):
 		''' return list of addresses '''
 		raise NotImplementedError('')
+	def breakpoint_set_many(self, addresses):
+		''' set software breakpoints, return {address: None or BreakpointSetError} '''
+		result = {}
+		for address in addresses:
+			try:
+				self.breakpoint_set(address)
+				result[address] = None
+			except BreakpointSetError as e:
+				result[address] = e
+		return result
+	def breakpoint_clear_many(self, addresses):
+		''' delete breakpoints, return {address: None or BreakpointClearError} '''
+		result = {}
+		for address in addresses:
+			try:
+				self.breakpoint_clear(address)
+				result[address] = None
+			except BreakpointClearError as e:
+				result[address] = e
+		return result
+
+	# hardware breakpoints and watchpoints
+	# kind is 'execute' (a hardware breakpoint), 'write', 'read', or 'access'
+	def watchpoint_set(self, address, size, kind):
+		''' stop when [address, address+size) is executed/written/read/accessed '''
+		raise NotImplementedError('')
+	def watchpoint_clear(self, address, size, kind):
+		raise NotImplementedError('')
+	def watchpoint_list(self):
+		''' return list of (address, size, kind) '''
+		raise NotImplementedError('')
 
 	# register
 	def reg_read(self, reg):
@@ -115,6 +161,13 @@ class DebugAdapter:
 		raise NotImplementedError('')
 	def reg_bits(self, reg):
 		raise NotImplementedError('')
+	def reg_name_pc(self):
+		''' name of the instruction pointer register, eg: 'rip' '''
+		names = self.reg_list()
+		for name in ['rip', 'eip', 'pc']:
+			if name in names:
+				return name
+		raise GeneralError('no instruction pointer among the registers')
 
 	# mem
 	def mem_read(self, address, length):
@@ -123,19 +176,92 @@ class DebugAdapter:
 		raise NotImplementedError('')
 	def mem_modules(self):
 		raise NotImplementedError('')
+	def mem_regions(self):
+		''' return sorted list of mapped (start, end, permissions), eg: (0x400000, 0x401000, 'rx') '''
+		raise NotImplementedError('')
+	def mem_compare(self, address, data):
+		''' does memory at address still hold data, answered cheaper than reading it (eg: by checksum) '''
+		raise NotImplementedError('')
+	def modules_changed(self):
+		''' were libraries loaded or unloaded (or a new program exec'd) since the last call, False when the adapter can't tell '''
+		(result, self.modules_dirty) = (self.modules_dirty, False)
+		return result
 
 	# break
 	def break_into(self):
 		raise NotImplementedError('')
 
 	# execution control
+	# resuming from an address with a breakpoint runs the instruction there,
+	# the adapter (or the stub behind it) steps off the breakpoint itself
 	def go():
 		raise NotImplementedError('')
 	def step_into(self):
 		raise NotImplementedError('')
 	def step_over(self):
 		raise NotImplementedError('')
+	def step_range(self, start, end):
+		''' step until pc leaves [start, end) or reaches a breakpoint '''
+		breakpoints = self.breakpoint_list()
+		pc_name = self.reg_name_pc()
+		while 1:
+			(reason, data) = self.step_into()
+			if reason != STOP_REASON.SIGNAL_TRAP:
+				return (reason, data)
+			pc = self.reg_read(pc_name)
+			if not (start <= pc < end) or pc in breakpoints:
+				return (reason, data)
 
 	# raw pass-thru (meaning depends on adapter)
 	def raw(self, data):
 		raise NotImplementedError('')
+
+	#--------------------------------------------------------------------------
+	# helpers for adapters, NOT part of the API
+	#--------------------------------------------------------------------------
+
+	# name of the register numbered rid in condition bytecode
+	def reg_name_from_id(self, rid):
+		raise NotImplementedError('')
+
+	# plant the library breakpoint, raises BreakpointSetError
+	def library_breakpoint_insert(self, addr):
+		raise NotImplementedError('')
+
+	# breakpoint the dynamic linker's function called on library loads and
+	# unloads, stops there are resumed by go() (unless the user has a
+	# breakpoint there too)
+	def library_breakpoint_set(self, addr):
+		if addr == None:
+			return
+		self.library_breakpoint_insert(addr)
+		self.library_breakpoint = addr
+
+	# stopped at the library breakpoint, returns True when the stop is only ours
+	def library_event_at_stop(self, reason):
+		if self.library_breakpoint == None or reason != STOP_REASON.SIGNAL_TRAP:
+			return False
+		if self.reg_read(self.reg_name_pc()) != self.library_breakpoint:
+			return False
+
+		self.modules_dirty = True
+		return not self.library_breakpoint in self.breakpoint_list()
+
+	# stopped at a breakpoint whose condition doesn't hold, go() resumes
+	# (stepping off it first)
+	def condition_false_at_stop(self, reason):
+		from . import agentexpr
+
+		if not self.breakpoint_conditions or reason != STOP_REASON.SIGNAL_TRAP:
+			return False
+
+		code = self.breakpoint_conditions.get(self.reg_read(self.reg_name_pc()))
+		if not code:
+			return False
+
+		reg_read = lambda rid: self.reg_read(self.reg_name_from_id(rid))
+		try:
+			return not agentexpr.evaluate(code, reg_read, self.mem_read)
+		except Exception:
+			# like gdbserver, a condition that can't be evaluated stops
+			return False
@@ -5,6 +5,7 @@ from binaryninja import BinaryView, SegmentFlag
 from . import binjaplug
 from . import DebugAdapter
 from . import dbgeng
+from . import memcache
 
 """
 The debug memory BinaryView layout is in a few pieces:
@@ -12,6 +13,16 @@ The debug memory BinaryView layout is in a few pieces:
 - DebugMemoryView represents the raw memory of the process (eg like a raw BinaryView)
 """
 
+def perms_to_flags(perms):
+	flags = 0
+	if 'r' in perms:
+		flags |= SegmentFlag.SegmentReadable
+	if 'w' in perms:
+		flags |= SegmentFlag.SegmentWritable
+	if 'x' in perms:
+		flags |= SegmentFlag.SegmentExecutable
+	return flags
+
 class DebugProcessView(BinaryView):
 	name = "Debugged Process"
 	def __init__(self, parent):
@@ -22,11 +33,19 @@ class DebugProcessView(BinaryView):
 		self.arch = parent.arch
 		self.platform = parent.platform
 
-		# TODO: Read segments from debugger
+		# until the target's memory map is known, one segment covers it all
 		length = self.memory.perform_get_length()
-		self.add_auto_segment(0, length, 0, length, SegmentFlag.SegmentReadable | SegmentFlag.SegmentWritable | SegmentFlag.SegmentExecutable)
+		self.segment_regions = [(0, length, 'rwx')]
+		self.add_auto_segment(0, length, 0, length, perms_to_flags('rwx'))
 		self.add_auto_section("Memory", 0, length)
 
+		# segments were built from the target's map since it started
+		self.regions_known = False
+		# the map may have changed since it was read (we stopped since)
+		self.regions_stale = True
+		# the cache learned a newer map than the segments show
+		self.segments_stale = False
+
 	def perform_get_address_size(self):
 		return self.parent_view.arch.address_size
 
@@ -41,10 +60,84 @@ class DebugProcessView(BinaryView):
 		return True
 
 	def perform_is_valid_offset(self, addr):
-		return True
+		return self.is_mapped(addr)
 
 	def mark_dirty(self):
 		self.memory.mark_dirty()
+		self.regions_stale = True
+		if binjaplug.get_state(self.local_view).adapter is None:
+			self.regions_known = False
+
+	"""
+	Is all of [addr, addr+length) mapped in the target, answered from the
+	memory map (re-read once per stop when it says no, eg: for a new heap
+	or thread stack)
+	"""
+	def is_mapped(self, addr, length=1):
+		if self.memory.cache.is_mapped(addr, length):
+			return True
+		if not self.regions_stale:
+			return False
+
+		# called from reads, segments are brought up to date at the next stop
+		self.memory.cache.set_regions(self.read_regions())
+		self.regions_stale = False
+		self.segments_stale = True
+		return self.memory.cache.is_mapped(addr, length)
+
+	"""
+	The target's memory map, None when the adapter can't tell
+	"""
+	def read_regions(self):
+		adapter = binjaplug.get_state(self.local_view).adapter
+		if adapter is None:
+			return None
+		try:
+			return adapter.mem_regions()
+		except (NotImplementedError, DebugAdapter.GeneralError, OSError):
+			return None
+
+	"""
+	Learn the target's memory map: segments are made to match (only the
+	regions that changed are touched), read-only memory stays cached across
+	stops, and reads of unmapped memory fail without asking the target
+	"""
+	def update_regions(self, regions):
+		self.segments_stale = False
+		self.regions_known = regions != None
+
+		segment_regions = regions
+		if regions == None:
+			length = self.memory.perform_get_length()
+			segment_regions = [(0, length, 'rwx')]
+
+		(old, new) = (set(self.segment_regions), set(segment_regions))
+		for (start, end, perms) in old - new:
+			self.remove_auto_segment(start, end - start)
+			self.memory.cache.drop(start, end - start)
+		for (start, end, perms) in sorted(new - old):
+			self.add_auto_segment(start, end - start, start, end - start, perms_to_flags(perms))
+		self.segment_regions = segment_regions
+
+		self.memory.cache.set_regions(regions)
+
+	"""
+	At a stop, re-read the memory map on the first stop and when the adapter
+	saw libraries loaded or unloaded (or an exec), otherwise the segments
+	only catch up with what reads found out (see is_mapped())
+	"""
+	def update_modules(self):
+		adapter = binjaplug.get_state(self.local_view).adapter
+		if adapter.modules_changed() or not self.regions_known:
+			regions = self.read_regions()
+			self.regions_stale = False
+			# (None, eg: the process just exited)
+			if regions != None or not self.regions_known:
+				self.update_regions(regions)
+				return
+
+		if self.segments_stale:
+			self.update_regions(self.memory.cache.regions)
 
 	"""
 	Update cached base address for the remote process
@@ -108,8 +201,7 @@ class DebugMemoryView(BinaryView):
 	name = "Debugged Process Memory"
 	def __init__(self, parent):
 		BinaryView.__init__(self, parent_view=parent, file_metadata=parent.file)
-		self.value_cache = {}
-		self.error_cache = {}
+		self.cache = memcache.PageCache()
 		self.arch = parent.arch
 		self.platform = parent.platform
 
@@ -125,55 +217,22 @@ class DebugMemoryView(BinaryView):
 		return (2 ** (self.perform_get_address_size() * 8)) - 1
 
 	def perform_read(self, addr, length):
-		adapter = binjaplug.get_state(self.parent_view).adapter
-		if adapter is None:
+		state = binjaplug.get_state(self.parent_view)
+		if state.adapter is None:
+			return None
+
+		# unmapped memory fails here, without a round trip
+		if not state.memory_view.is_mapped(addr, length):
 			return None
 
-		# ProcessView implements read caching in a manner inspired by CPU cache:
-		# Reads are aligned on 256-byte boundaries and 256 bytes long
-
-		# Cache read start: round down addr to nearest 256 byte boundary
-		cache_start = addr & ~0xFF
-		# Cache read end: round up addr+length to nearest 256 byte boundary
-		cache_end = (addr + length + 0xFF) & ~0xFF
-		# Cache read length: accounting for rounding down start and rounding up end
-		cache_len = cache_end - cache_start
-		# List of 256-byte block addresses to read into the cache to fully cover this region
-		cache_blocks = range(cache_start, cache_start + cache_len, 0x100)
-
-		for block in cache_blocks:
-			if block in self.error_cache:
-				return None
-			if block not in self.value_cache:
-				try:
-					batch = adapter.mem_read(block, cache_len)
-					# Cache storage is addr => byte for every byte
-					# Not memory efficient but very easy to reason about
-					batch = {block+offs:val.to_bytes(1,'big') for (offs,val) in enumerate(batch)}
-					self.value_cache.update(batch)
-				except DebugAdapter.GeneralError as e:
-					# Probably disconnected; can't read
-					self.error_cache[block] = True
-					return None
-
-		# Now that we know we have cached every address in the region, assemble the
-		# result solely from the cache
-		return b''.join(self.value_cache[val] for val in range(addr, addr + length))
+		# reads go through a cache of whole pages, see memcache
+		return self.cache.read(state.adapter, addr, length)
 
 	def perform_write(self, addr, data):
 		adapter = binjaplug.get_state(self.parent_view).adapter
 		if adapter is None:
 			return 0
-		# Assume any memory change invalidates all of memory (suboptimal, may not be necessary)
-		self.mark_dirty()
-		try:
-			if adapter.mem_write(addr, data) == 0:
-				return len(data)
-			else:
-				return 0
-		except DebugAdapter.GeneralError as e:
-			# Probably disconnected
-			return 0
+		return self.cache.write_through(adapter, addr, data)
 
 	def perform_is_executable(self):
 		return True
@@ -194,8 +253,12 @@ class DebugMemoryView(BinaryView):
 	# def perform_is_relocatable(self):
 
 	def mark_dirty(self):
-		self.value_cache = {}
-		self.error_cache = {}
+		adapter = binjaplug.get_state(self.parent_view).adapter
+		if adapter is None:
+			self.cache.clear()
+			self.cache.set_regions(None)
+		else:
+			self.cache.invalidate(adapter.mem_compare)
 
 DebugProcessView.register()
 DebugMemoryView.register()
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+# compile breakpoint conditions to gdb agent expression bytecode, see:
+# https://sourceware.org/gdb/current/onlinedocs/gdb/Agent-Expressions.html
+#
+# conditions are python expressions over registers and memory, eg:
+#
+#   rdi == 3 and u32(rsp+8) != 0
+#
+# u8(), u16(), u32(), u64() read memory, comparisons are unsigned, arithmetic
+# wraps at 64 bits
+#
+# the bytecode goes to the stub in the Z0 packet, or is evaluated here by
+# evaluate() when the stub can't, so both sides agree on what a condition means
+
+import ast
+from struct import pack, unpack
+
+from . import DebugAdapter
+
+OP = {
+	'add': 0x02, 'sub': 0x03, 'mul': 0x04, 'div_unsigned': 0x06,
+	'rem_unsigned': 0x08, 'lsh': 0x09, 'rsh_unsigned': 0x0b, 'log_not': 0x0e,
+	'bit_and': 0x0f, 'bit_or': 0x10, 'bit_xor': 0x11, 'bit_not': 0x12,
+	'equal': 0x13, 'less_unsigned': 0x15, 'ref8': 0x17, 'ref16': 0x18,
+	'ref32': 0x19, 'ref64': 0x1a, 'if_goto': 0x20, 'goto': 0x21,
+	'const8': 0x22, 'const16': 0x23, 'const32': 0x24, 'const64': 0x25,
+	'reg': 0x26, 'end': 0x27, 'dup': 0x28, 'pop': 0x29, 'swap': 0x2b
+}
+
+MASK = 0xFFFFFFFFFFFFFFFF
+
+binop_to_op = {
+	ast.Add: 'add', ast.Sub: 'sub', ast.Mult: 'mul', ast.FloorDiv: 'div_unsigned',
+	ast.Mod: 'rem_unsigned', ast.LShift: 'lsh', ast.RShift: 'rsh_unsigned',
+	ast.BitAnd: 'bit_and', ast.BitOr: 'bit_or', ast.BitXor: 'bit_xor'
+}
+
+# comparison -> (swap operands?, ops)
+cmpop_to_ops = {
+	ast.Eq: (False, ['equal']),
+	ast.NotEq: (False, ['equal', 'log_not']),
+	ast.Lt: (False, ['less_unsigned']),
+	ast.Gt: (True, ['less_unsigned']),
+	ast.LtE: (True, ['less_unsigned', 'log_not']),
+	ast.GtE: (False, ['less_unsigned', 'log_not'])
+}
+
+func_to_ref = {'u8': 'ref8', 'u16': 'ref16', 'u32': 'ref32', 'u64': 'ref64'}
+
+#--------------------------------------------------------------------------
+# compiler
+#--------------------------------------------------------------------------
+
+# compile condition text to bytecode, regs maps register name -> number
+def compile_expr(text, regs):
+	try:
+		tree = ast.parse(text.strip(), mode='eval')
+	except SyntaxError as e:
+		raise DebugAdapter.GeneralError('parsing condition: %s' % e.msg)
+
+	code = bytearray()
+	emit(tree.body, code, regs)
+	code.append(OP['end'])
+	return bytes(code)
+
+def emit_const(value, code):
+	value &= MASK
+	for (op, fmt, limit) in [('const8', '>B', 0x100), ('const16', '>H', 0x10000),
+	  ('const32', '>I', 0x100000000), ('const64', '>Q', MASK+1)]:
+		if value < limit:
+			code.append(OP[op])
+			code += pack(fmt, value)
+			return
+
+# leave 0 or 1 on the stack for "and", "or"
+def emit_bool(node, code, regs):
+	emit(node, code, regs)
+	code += bytes([OP['log_not'], OP['log_not']])
+
+def emit(node, code, regs):
+	if isinstance(node, ast.Constant) and type(node.value) == int:
+		emit_const(node.value, code)
+
+	elif isinstance(node, ast.Name):
+		if not node.id in regs:
+			raise DebugAdapter.GeneralError('unknown register in condition: %s' % node.id)
+		code.append(OP['reg'])
+		code += pack('>H', regs[node.id])
+
+	elif isinstance(node, ast.BinOp) and type(node.op) in binop_to_op:
+		emit(node.left, code, regs)
+		emit(node.right, code, regs)
+		code.append(OP[binop_to_op[type(node.op)]])
+
+	elif isinstance(node, ast.UnaryOp):
+		if isinstance(node.op, ast.USub):
+			emit_const(0, code)
+			emit(node.operand, code, regs)
+			code.append(OP['sub'])
+		elif isinstance(node.op, ast.UAdd):
+			emit(node.operand, code, regs)
+		else:
+			emit(node.operand, code, regs)
+			code.append(OP['log_not' if isinstance(node.op, ast.Not) else 'bit_not'])
+
+	elif isinstance(node, ast.Compare):
+		if len(node.ops) != 1 or not type(node.ops[0]) in cmpop_to_ops:
+			raise DebugAdapter.GeneralError('unsupported comparison in condition')
+		(swap, ops) = cmpop_to_ops[type(node.ops[0])]
+		emit(node.left, code, regs)
+		emit(node.comparators[0], code, regs)
+		if swap:
+			code.append(OP['swap'])
+		code += bytes([OP[op] for op in ops])
+
+	# short circuit: a false (and) or true (or) operand skips the rest with
+	# itself as the result
+	elif isinstance(node, ast.BoolOp):
+		patches = []
+		for (i, value) in enumerate(node.values):
+			emit_bool(value, code, regs)
+			if i == len(node.values)-1:
+				break
+			code.append(OP['dup'])
+			if isinstance(node.op, ast.And):
+				code.append(OP['log_not'])
+			code.append(OP['if_goto'])
+			patches.append(len(code))
+			code += b'\x00\x00'
+			code.append(OP['pop'])
+		for offset in patches:
+			code[offset:offset+2] = pack('>H', len(code))
+
+	elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and \
+	  node.func.id in func_to_ref and len(node.args) == 1 and not node.keywords:
+		emit(node.args[0], code, regs)
+		code.append(OP[func_to_ref[node.func.id]])
+
+	else:
+		raise DebugAdapter.GeneralError('unsupported in condition: %s' % ast.dump(node))
+
+#--------------------------------------------------------------------------
+# evaluator
+#--------------------------------------------------------------------------
+
+binary = {
+	OP['add']: lambda a, b: a + b,
+	OP['sub']: lambda a, b: a - b,
+	OP['mul']: lambda a, b: a * b,
+	OP['div_unsigned']: lambda a, b: a // b,
+	OP['rem_unsigned']: lambda a, b: a % b,
+	OP['lsh']: lambda a, b: a << b if b < 64 else 0,
+	OP['rsh_unsigned']: lambda a, b: a >> b,
+	OP['bit_and']: lambda a, b: a & b,
+	OP['bit_or']: lambda a, b: a | b,
+	OP['bit_xor']: lambda a, b: a ^ b,
+	OP['equal']: lambda a, b: int(a == b),
+	OP['less_unsigned']: lambda a, b: int(a < b)
+}
+
+ref_to_size = {OP['ref8']: 1, OP['ref16']: 2, OP['ref32']: 4, OP['ref64']: 8}
+
+const_to_fmt = {OP['const8']: '>B', OP['const16']: '>H', OP['const32']: '>I', OP['const64']: '>Q'}
+
+# run bytecode, reg_read(number) -> int, mem_read(address, length) -> bytes
+def evaluate(code, reg_read, mem_read, endian='little'):
+	stack = []
+	pc = 0
+	while 1:
+		op = code[pc]
+		pc += 1
+
+		if op == OP['end']:
+			return stack[-1]
+
+		elif op in binary:
+			b = stack.pop()
+			a = stack.pop()
+			stack.append(binary[op](a, b) & MASK)
+
+		elif op == OP['log_not']:
+			stack.append(int(not stack.pop()))
+		elif op == OP['bit_not']:
+			stack.append(~stack.pop() & MASK)
+
+		elif op in ref_to_size:
+			size = ref_to_size[op]
+			stack.append(int.from_bytes(mem_read(stack.pop(), size)[0:size], endian))
+
+		elif op in const_to_fmt:
+			fmt = const_to_fmt[op]
+			size = {'B':1, 'H':2, 'I':4, 'Q':8}[fmt[1]]
+			stack.append(unpack(fmt, code[pc:pc+size])[0])
+			pc += size
+
+		elif op == OP['reg']:
+			stack.append(reg_read(unpack('>H', code[pc:pc+2])[0]) & MASK)
+			pc += 2
+
+		elif op == OP['if_goto']:
+			if stack.pop():
+				pc = unpack('>H', code[pc:pc+2])[0]
+			else:
+				pc += 2
+		elif op == OP['goto']:
+			pc = unpack('>H', code[pc:pc+2])[0]
+
+		elif op == OP['dup']:
+			stack.append(stack[-1])
+		elif op == OP['pop']:
+			stack.pop()
+		elif op == OP['swap']:
+			stack[-2:] = [stack[-1], stack[-2]]
+
+		else:
+			raise DebugAdapter.GeneralError('unsupported agent expression opcode: 0x%02X' % op)
@@ -1,6 +1,7 @@
 import os
 import re
-import time
+import itertools
+from collections import deque
 
 import binaryninja
 from binaryninja import Symbol, SymbolType, Type, Structure, StructureType
@@ -41,6 +42,9 @@ def delete_state(bv):
 			DebuggerState.states.pop(i)
 			return
 
+# how many logpoint hits are remembered
+LOGPOINT_RECORDS_MAX = 10000
+
 #------------------------------------------------------------------------------
 # DEBUGGER STATE / CONTROLLER
 #
@@ -56,11 +60,19 @@ class DebuggerState:
 		self.state = 'INACTIVE'
 		# address -> adapter id
 		self.breakpoints = {}
+		# address -> times stopped there
+		self.breakpoint_hits = {}
+		# address -> capture spec, see logpoint_set()
+		self.logpoints = {}
+		# logpoint hits, oldest first
+		self.logpoint_records = deque(maxlen=LOGPOINT_RECORDS_MAX)
 		self.memory_view = ProcessView.DebugProcessView(bv)
 		self.old_symbols = []
 		self.old_dvs = set()
 		self.last_rip = 0
 		self.command_line_args = []
+		# gdbserver's inferior memory through /proc/<pid>/mem, see AdapterSettingsDialog
+		self.local_mem = False
 
 		if have_ui:
 			self.ui = ui.DebuggerUI(self)
@@ -74,6 +86,8 @@ class DebuggerState:
 	# Mark memory as dirty, will refresh memory view
 	def memory_dirty(self):
 		self.memory_view.mark_dirty()
+		if self.adapter is not None:
+			self.memory_view.update_modules()
 
 	# Create symbols and variables for the memory view
 	def update_memory_view(self):
@@ -193,7 +207,7 @@ class DebuggerState:
 		if not os.path.exists(fpath):
 			raise Exception('cannot find debug target: ' + fpath)
 
-		self.adapter = DebugAdapter.get_adapter_for_current_system(stdout=self.on_stdout)
+		self.adapter = DebugAdapter.get_adapter_for_current_system(stdout=self.on_stdout, local_mem=self.local_mem)
 		self.adapter.exec(fpath, self.command_line_args)
 
 		self.memory_view.update_base()
@@ -219,8 +233,9 @@ class DebuggerState:
 		self.memory_dirty()
 
 	def restart(self):
+		# quit() returns once the stub and target exited
 		self.quit()
-		time.sleep(1)
+		self.breakpoint_hits_reset()
 		self.run() # sets state
 
 	def detach(self):
@@ -248,49 +263,39 @@ class DebuggerState:
 		if not self.adapter:
 			raise Exception('missing adapter')
 
-		remote_rip = self.adapter.reg_read('rip')
-		local_rip = self.memory_view.remote_addr_to_local(remote_rip)
-		bphere = local_rip in self.breakpoints
-
-		seq = []
-		if bphere:
-			seq.append((self.adapter.breakpoint_clear, (remote_rip,)))
-			seq.append((self.adapter.go, ()))
-			seq.append((self.adapter.breakpoint_set, (remote_rip,)))
-		else:
-			seq.append((self.adapter.go, ()))
-
-		result = self.exec_adapter_sequence(seq)
+		result = self.adapter_go()
 		self.memory_dirty()
 		return result
 
+	# resume the target, every run of it goes through here so breakpoint hits
+	# are counted and logpoint hits recorded (and resumed) the same way, only
+	# other stops return
+	def adapter_go(self):
+		pc_name = self.adapter.reg_name_pc()
+
+		while 1:
+			(reason, data) = self.adapter.go()
+			if reason != DebugAdapter.STOP_REASON.SIGNAL_TRAP:
+				break
+
+			local_pc = self.memory_view.remote_addr_to_local(self.adapter.reg_read(pc_name))
+			if not local_pc in self.breakpoints:
+				break
+			self.breakpoint_hits[local_pc] = self.breakpoint_hits.get(local_pc, 0) + 1
+			if not local_pc in self.logpoints:
+				break
+			self.logpoint_record(local_pc)
+
+		return (reason, data)
+
 	def step_into(self):
 		if not self.adapter:
 			raise Exception('missing adapter')
 
-		(reason, data) = (None, None)
-
-		if self.bv.arch.name == 'x86_64':
-			remote_rip = self.adapter.reg_read('rip')
-			local_rip = self.memory_view.remote_addr_to_local(remote_rip)
-
-			# if currently a breakpoint at rip, temporarily clear it
-			# TODO: detect windbg adapter because dbgeng's step behavior might ignore breakpoint
-			# at current rip
-
-			seq = []
-			if local_rip in self.breakpoints:
-				seq.append((self.adapter.breakpoint_clear, (remote_rip,)))
-				seq.append((self.adapter.step_into, ()))
-				seq.append((self.adapter.breakpoint_set, (remote_rip,)))
-			else:
-				seq.append((self.adapter.step_into, ()))
-			# TODO: Cancel (and raise some exception)
-			result = self.exec_adapter_sequence(seq)
-			self.memory_dirty()
-			return result
-		else:
-			raise NotImplementedError('step unimplemented for architecture %s' % self.bv.arch.name)
+		# TODO: Cancel (and raise some exception)
+		result = self.adapter.step_into()
+		self.memory_dirty()
+		return result
 
 	def step_over(self):
 		if not self.adapter:
@@ -301,60 +306,18 @@ class DebuggerState:
 		except NotImplementedError:
 			pass
 
-		if self.bv.arch.name == 'x86_64':
-			remote_rip = self.adapter.reg_read('rip')
-			local_rip = self.memory_view.remote_addr_to_local(remote_rip)
-
-			if self.bv.read(local_rip, 1):
-				instxt = self.bv.get_disassembly(local_rip)
-				inslen = self.bv.get_instruction_length(local_rip)
-			else:
-				data = self.adapter.mem_read(remote_rip, 16)
-				(tokens, length) = self.bv.arch.get_instruction_text(data, local_rip)
-				instxt = ''.join([x.text for x in tokens])
-				inslen = length
-
-			local_ripnext = local_rip + inslen
-			remote_ripnext = remote_rip + inslen
-
-			call = instxt.startswith('call ')
-			bphere = local_rip in self.breakpoints
-			bpnext = local_ripnext in self.breakpoints
-
-			seq = []
-
-			if not call:
-				if bphere:
-					seq.append((self.adapter.breakpoint_clear, (remote_rip,)))
-					seq.append((self.adapter.step_into, ()))
-					seq.append((self.adapter.breakpoint_set, (remote_rip,)))
-				else:
-					seq.append((self.adapter.step_into, ()))
-			elif bphere and bpnext:
-				seq.append((self.adapter.breakpoint_clear, (remote_rip,)))
-				seq.append((self.adapter.go, ()))
-				seq.append((self.adapter.breakpoint_set, (remote_rip,)))
-			elif bphere and not bpnext:
-				seq.append((self.adapter.breakpoint_clear, (remote_rip,)))
-				seq.append((self.adapter.breakpoint_set, (remote_ripnext,)))
-				seq.append((self.adapter.go, ()))
-				seq.append((self.adapter.breakpoint_clear, (remote_ripnext,)))
-				seq.append((self.adapter.breakpoint_set, (remote_rip,)))
-			elif not bphere and bpnext:
-				seq.append((self.adapter.go, ()))
-			elif not bphere and not bpnext:
-				seq.append((self.adapter.breakpoint_set, (remote_ripnext,)))
-				seq.append((self.adapter.go, ()))
-				seq.append((self.adapter.breakpoint_clear, (remote_ripnext,)))
-			else:
-				raise Exception('confused by call, bphere, bpnext state')
-			# TODO: Cancel (and raise some exception)
-			result = self.exec_adapter_sequence(seq)
-			self.memory_dirty()
-			return result
+		remote_pc = self.adapter.reg_read(self.adapter.reg_name_pc())
+		local_pc = self.memory_view.remote_addr_to_local(remote_pc)
 
+		if self.bv.read(local_pc, 1):
+			inslen = self.bv.get_instruction_length(local_pc)
 		else:
-			raise NotImplementedError('step over unimplemented for architecture %s' % self.bv.arch.name)
+			data = self.adapter.mem_read(remote_pc, self.bv.arch.max_instr_length)
+			inslen = self.bv.arch.get_instruction_info(data, local_pc).length
+
+		# a call leaves the instruction and is run until it returns right after
+		# it, see step_over_range()
+		return self.step_over_range(remote_pc, remote_pc + inslen)
 
 	def step_return(self):
 		if not self.adapter:
@@ -369,28 +332,19 @@ class DebuggerState:
 			if len(funcs) != 0:
 				mlil = funcs[0].mlil
 
-				bphere = local_rip in self.breakpoints
-
-				# Set a bp on every ret in the function and go
-				old_bps = set()
+				# Set a bp on every ret in the function (lacking one) and go
 				new_bps = set()
 				for insn in mlil.instructions:
 					if insn.operation == binaryninja.MediumLevelILOperation.MLIL_RET or insn.operation == binaryninja.MediumLevelILOperation.MLIL_TAILCALL:
-						if insn.address in self.breakpoints:
-							rets.add(self.memory_view.local_addr_to_remote(insn.address))
-						else:
+						if not insn.address in self.breakpoints:
 							new_bps.add(self.memory_view.local_addr_to_remote(insn.address))
 
 				seq = []
-				if bphere and not local_rip in new_bps and not local_rip in old_bps:
-					seq.append((self.adapter.breakpoint_clear, (remote_rip,)))
 				for bp in new_bps:
 					seq.append((self.adapter.breakpoint_set, (bp,)))
-				seq.append((self.adapter.go, ()))
+				seq.append((self.adapter_go, ()))
 				for bp in new_bps:
 					seq.append((self.adapter.breakpoint_clear, (bp,)))
-				if bphere and not local_rip in new_bps and not local_rip in old_bps:
-					seq.append((self.adapter.breakpoint_set, (remote_rip,)))
 				# TODO: Cancel (and raise some exception)
 				result = self.exec_adapter_sequence(seq)
 				self.memory_dirty()
@@ -402,6 +356,56 @@ class DebuggerState:
 		else:
 			raise NotImplementedError('step over unimplemented for architecture %s' % self.bv.arch.name)
 
+	# step until pc leaves [start, end) (remote addresses), eg: a basic block or
+	# source line, running calls made from inside the range to their return
+	#
+	# a call is recognized by the return address it pushed, so architectures
+	# that call through a link register aren't supported
+	def step_over_range(self, start, end):
+		if not self.adapter:
+			raise Exception('missing adapter')
+
+		arch = self.bv.arch
+		if arch.link_reg:
+			raise NotImplementedError('step over range unimplemented for architecture %s' % arch.name)
+		pc_name = self.adapter.reg_name_pc()
+		endian = 'little' if arch.endianness == binaryninja.Endianness.LittleEndian else 'big'
+
+		while 1:
+			(reason, data) = self.adapter.step_range(start, end)
+			if reason != DebugAdapter.STOP_REASON.SIGNAL_TRAP:
+				break
+
+			# stopped by a breakpoint, in the range or just out of it
+			remote_pc = self.adapter.reg_read(pc_name)
+			if self.memory_view.remote_addr_to_local(remote_pc) in self.breakpoints:
+				break
+
+			# left it by a call when the return address on the stack is back in
+			# (or right after) the range
+			stack = self.adapter.mem_read(self.adapter.reg_read(arch.stack_pointer), arch.address_size)
+			remote_ret = int.from_bytes(stack, endian)
+			if not (start < remote_ret <= end):
+				break
+
+			# a breakpoint the user set at the return address stops us there
+			bpret = self.memory_view.remote_addr_to_local(remote_ret) in self.breakpoints
+			seq = []
+			if not bpret:
+				seq.append((self.adapter.breakpoint_set, (remote_ret,)))
+				seq.append((self.adapter_go, ()))
+				seq.append((self.adapter.breakpoint_clear, (remote_ret,)))
+			else:
+				seq.append((self.adapter_go, ()))
+			(reason, data) = self.exec_adapter_sequence(seq)
+			if reason != DebugAdapter.STOP_REASON.SIGNAL_TRAP or self.adapter.reg_read(pc_name) != remote_ret:
+				break
+			if bpret or remote_ret == end:
+				break
+
+		self.memory_dirty()
+		return (reason, data)
+
 	def breakpoint_set(self, remote_address):
 		if not self.adapter:
 			raise Exception('missing adapter')
@@ -420,6 +424,50 @@ class DebuggerState:
 
 		return True
 
+	# a logpoint is a breakpoint that records and resumes instead of stopping
+	#
+	# regs: register names to capture, eg: ['rdi', 'rsi']
+	# mems: (register, offset, length) of memory to capture, eg: [('rsp', 8, 16)]
+	def logpoint_set(self, remote_address, regs=None, mems=None):
+		local_address = self.memory_view.remote_addr_to_local(remote_address)
+		spec = {'regs': list(regs or []), 'mems': list(mems or [])}
+
+		# only a breakpoint that made it to the target becomes a logpoint
+		if not local_address in self.breakpoints:
+			try:
+				self.breakpoint_set(remote_address)
+			except DebugAdapter.BreakpointSetError:
+				return False
+
+		self.logpoints[local_address] = spec
+		return True
+
+	# forget the counts and records of a process, its breakpoints stay
+	def breakpoint_hits_reset(self):
+		self.breakpoint_hits = {}
+		self.logpoint_records.clear()
+
+	def logpoint_record(self, local_address):
+		spec = self.logpoints[local_address]
+
+		record = {
+			'address': local_address,
+			'hit': self.breakpoint_hits.get(local_address, 0),
+			'tid': self.adapter.thread_selected(),
+			'regs': {},
+			'mems': {}
+		}
+		for reg in spec['regs']:
+			record['regs'][reg] = self.adapter.reg_read(reg)
+		for (reg, offset, length) in spec['mems']:
+			try:
+				data = self.adapter.mem_read(self.adapter.reg_read(reg) + offset, length)
+			except DebugAdapter.GeneralError:
+				data = None
+			record['mems'][(reg, offset, length)] = data
+
+		self.logpoint_records.append(record)
+
 	def breakpoint_clear(self, remote_address):
 		if not self.adapter:
 			raise Exception('missing adapter')
@@ -439,6 +487,8 @@ class DebuggerState:
 
 			# delete from our list
 			del self.breakpoints[local_address]
+			self.breakpoint_hits.pop(local_address, None)
+			self.logpoints.pop(local_address, None)
 
 			self.update_highlights()
 			if self.ui is not None:
@@ -448,16 +498,31 @@ class DebuggerState:
 
 	# execute a sequence of adapter commands, capturing the return of the last
 	# blocking call
+	#
+	# adjacent breakpoint sets (or clears) go to the adapter as one batch
 	def exec_adapter_sequence(self, seq):
 		(reason, data) = (None, None)
 
-		for (func, args) in seq:
-			if func in [self.adapter.step_into, self.adapter.step_over, self.adapter.go]:
-				(reason, data) = func(*args)
-				if reason == DebugAdapter.STOP_REASON.PROCESS_EXITED or reason == DebugAdapter.STOP_REASON.BACKEND_DISCONNECTED:
-					# Process is dead, stop sequence
-					break
-			else:
-				func(*args)
+		batches = {
+			self.adapter.breakpoint_set: self.adapter.breakpoint_set_many,
+			self.adapter.breakpoint_clear: self.adapter.breakpoint_clear_many
+		}
+
+		for (func, group) in itertools.groupby(seq, key=lambda x: x[0]):
+			if func in batches:
+				results = batches[func]([args[0] for (_, args) in group])
+				errors = [e for e in results.values() if e]
+				if errors:
+					raise errors[0]
+				continue
+
+			for (func, args) in group:
+				if func in [self.adapter.step_into, self.adapter.step_over, self.adapter.go, self.adapter_go]:
+					(reason, data) = func(*args)
+					if reason == DebugAdapter.STOP_REASON.PROCESS_EXITED or reason == DebugAdapter.STOP_REASON.BACKEND_DISCONNECTED:
+						# Process is dead, stop sequence
+						return (reason, data)
+				else:
+					func(*args)
 
 		return (reason, data)
@@ -2,6 +2,7 @@
 
 import re
 import os
+import string
 import sys
 import signal
 import platform
@@ -22,6 +23,8 @@ import debugger.DebugAdapter as DebugAdapter
 # globals
 adapter = None
 context_last = {}
+# address -> format of the message printed (instead of stopping) when hit
+logpoints = {}
 
 #--------------------------------------------------------------------------
 # COMMON DEBUGGER TASKS
@@ -89,6 +92,12 @@ def thread_display():
 def debug_status():
 	return
 
+# print a logpoint's message, eg: "rdi={rdi:x} count={rcx}" fills in registers
+def logpoint_display(fmt):
+	names = [field for (_, field, _, _) in string.Formatter().parse(fmt) if field]
+	regs = dict([(name, adapter.reg_read(name)) for name in names])
+	print('logpoint: ' + fmt.format(**regs))
+
 #--------------------------------------------------------------------------
 # MAIN
 #--------------------------------------------------------------------------
@@ -126,6 +135,19 @@ if __name__ == '__main__':
 	if platform.system() == 'Windows':
 		adjust_ctrl_c()
 
+	# adapter options, eg: --transport=pipe (gdbserver over its stdin/stdout)
+	adapter_kwargs = {}
+	while sys.argv[1:] and sys.argv[1].startswith('--'):
+		option = sys.argv.pop(1)
+		if option == '--ptrace':
+			adapter_kwargs['ptrace'] = True
+		elif option.startswith('--transport='):
+			adapter_kwargs['transport'] = option[12:]
+		elif option == '--local-mem':
+			adapter_kwargs['local_mem'] = True
+		else:
+			raise Exception('unknown option: %s' % option)
+
 	adapter = None
 	if not sys.argv[1:]:
 		raise Exception('specify target on command line')
@@ -140,9 +162,10 @@ if __name__ == '__main__':
 		if not os.path.exists(arg1):
 			raise Exception('file not found: %s' % arg1)
 
-		adapter = DebugAdapter.get_adapter_for_current_system()
+		adapter = DebugAdapter.get_adapter_for_current_system(**adapter_kwargs)
 
-	adapter.exec(arg1)
+	# anything after the target is its command line
+	adapter.exec(arg1, sys.argv[2:])
 
 	user_goal = 'debug'
 	while user_goal == 'debug':
@@ -168,21 +191,60 @@ if __name__ == '__main__':
 				print('switching to thread 0x%x' % tid)
 				adapter.thread_select(tid)
 
-			# breakpoint set/clear
+			# breakpoint set/clear, eg: "bp 401144 if rax == 3 and u32(rsp+8)"
 			elif text.startswith('bp '):
-				addr = int(text[3:], 16)
-				adapter.breakpoint_set(addr)
-				print('breakpoint set at 0x%X' % (addr))
+				(addr, _, condition) = text[3:].partition(' if ')
+				addr = int(addr, 16)
+				if condition:
+					adapter.breakpoint_set(addr, condition)
+					print('breakpoint set at 0x%X if %s' % (addr, condition))
+				else:
+					adapter.breakpoint_set(addr)
+					print('breakpoint set at 0x%X' % (addr))
+
+			# logpoint set, eg: "lp 401144 rax={rax:x}"
+			elif text.startswith('lp '):
+				m = re.match(r'^lp (\w+) (.*)$', text)
+				if not m:
+					print('usage: lp <addr> <format>')
+					continue
+				addr = int(m.group(1), 16)
+				if not addr in adapter.breakpoint_list():
+					adapter.breakpoint_set(addr)
+				logpoints[addr] = m.group(2)
+				print('logpoint set at 0x%X' % addr)
+
+			# hardware breakpoint/watchpoint set, eg: "ba w 8 404020"
+			elif text.startswith('ba '):
+				m = re.match(r'^ba ([ewra]) (\d+) (\w+)$', text)
+				if not m:
+					print('usage: ba <e|w|r|a> <size> <addr>')
+					continue
+				kind = {'e':'execute', 'w':'write', 'r':'read', 'a':'access'}[m.group(1)]
+				(size, addr) = (int(m.group(2)), int(m.group(3), 16))
+				adapter.watchpoint_set(addr, size, kind)
+				print('%s watchpoint set at 0x%X (%d bytes)' % (kind, addr, size))
 
 			elif text.startswith('bc '):
 				addr = int(text[3:], 16)
-				adapter.breakpoint_clear(addr)
-				print('breakpoint cleared at 0x%X' % addr)
+				if addr in adapter.breakpoint_list():
+					adapter.breakpoint_clear(addr)
+					logpoints.pop(addr, None)
+					print('breakpoint cleared at 0x%X' % addr)
+				for (waddr, size, kind) in adapter.watchpoint_list():
+					if waddr == addr:
+						adapter.watchpoint_clear(waddr, size, kind)
+						print('%s watchpoint cleared at 0x%X' % (kind, addr))
 
 			elif text == 'bl':
 				print('breakpoint list:')
 				for (i,addr) in enumerate(adapter.breakpoint_list()):
-					print('%d: 0x%X' % (i, addr))
+					if addr in logpoints:
+						print('%d: 0x%X log "%s"' % (i, addr, logpoints[addr]))
+					else:
+						print('%d: 0x%X' % (i, addr))
+				for (i,(addr, size, kind)) in enumerate(adapter.watchpoint_list()):
+					print('w%d: 0x%X %s %d' % (i, addr, kind, size))
 
 			# context, read regs, write regs
 			elif text in ['r']:
@@ -233,9 +295,17 @@ if __name__ == '__main__':
 
 					if reason == DebugAdapter.STOP_REASON.STDOUT_MESSAGE:
 						print('stdout: ', data)
+					elif text == 'g' and reason == DebugAdapter.STOP_REASON.SIGNAL_TRAP and \
+					  adapter.reg_read(adapter.reg_name_pc()) in logpoints:
+						logpoint_display(logpoints[adapter.reg_read(adapter.reg_name_pc())])
 					elif reason == DebugAdapter.STOP_REASON.PROCESS_EXITED:
 						print('process exited, return code=%d' % data)
 						break
+					elif reason in [DebugAdapter.STOP_REASON.WATCHPOINT_WRITE, \
+					  DebugAdapter.STOP_REASON.WATCHPOINT_READ, DebugAdapter.STOP_REASON.WATCHPOINT_ACCESS]:
+						print('stopped, reason: %s at 0x%X' % (reason.name, data))
+						context_display()
+						break
 					else:
 						print('stopped, reason: %s' % reason.name)
 						context_display()
@@ -113,7 +113,9 @@ class DebugAdapterDbgeng(DebugAdapter.DebugAdapter):
 			raise DebugAdapter.GeneralError("selecting thread")
 
 	# breakpoints
-	def breakpoint_set(self, addr):
+	def breakpoint_set(self, addr, condition=None):
+		if condition:
+			raise NotImplementedError('conditional breakpoints')
 		pfunc = self.dll.breakpoint_set
 		pfunc.restype = c_int
 		pfunc.argtypes = [c_ulonglong, POINTER(c_ulong)]
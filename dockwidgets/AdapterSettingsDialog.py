@@ -1,7 +1,7 @@
 from PySide2 import QtCore
 from PySide2.QtCore import Qt, QAbstractItemModel, QModelIndex, QSize
 from PySide2.QtGui import QPalette, QFontMetricsF
-from PySide2.QtWidgets import QApplication, QHBoxLayout, QVBoxLayout, QWidget, QDialog, QPushButton, QFormLayout, QLineEdit, QLabel
+from PySide2.QtWidgets import QApplication, QHBoxLayout, QVBoxLayout, QWidget, QDialog, QPushButton, QFormLayout, QLineEdit, QLabel, QCheckBox
 
 import binaryninja
 import binaryninjaui
@@ -31,11 +31,13 @@ class AdapterSettingsDialog(QDialog):
 		titleLayout.addWidget(titleLabel)
 
 		self.argumentsEntry = QLineEdit(self)
+		self.localMemEntry = QCheckBox(self)
 		# self.addressEntry = QLineEdit(self)
 		# self.portEntry = QLineEdit(self)
 
 		formLayout = QFormLayout()
 		formLayout.addRow("Command Line Arguments", self.argumentsEntry)
+		formLayout.addRow("Read Memory Through /proc (gdbserver)", self.localMemEntry)
 		# formLayout.addRow("Address", self.addressEntry)
 		# formLayout.addRow("Port", self.portEntry)
 
@@ -74,6 +76,7 @@ class AdapterSettingsDialog(QDialog):
 
 		self.argumentsEntry.setText(' ' .join(shlex.quote(arg) for arg in debug_state.command_line_args))
 		self.argumentsEntry.textEdited.connect(lambda: self.updateArguments())
+		self.localMemEntry.setChecked(debug_state.local_mem)
 
 		self.accepted.connect(lambda: self.apply())
 
@@ -88,6 +91,7 @@ class AdapterSettingsDialog(QDialog):
 		debug_state = binjaplug.get_state(self.bv)
 		arguments = shlex.split(self.argumentsEntry.text())
 		debug_state.command_line_args = arguments
+		debug_state.local_mem = self.localMemEntry.isChecked()
 
 	def updateArguments(self):
 		try:
@@ -16,7 +16,7 @@ class DebugBreakpointsListModel(QAbstractItemModel):
 	def __init__(self, parent, bv):
 		QAbstractItemModel.__init__(self, parent)
 		self.bv = bv
-		self.columns = ["Enabled", "Address"]
+		self.columns = ["Enabled", "Address", "Hits"]
 		self.update_rows(None)
 
 	def update_rows(self, new_rows):
@@ -88,6 +88,8 @@ class DebugBreakpointsListModel(QAbstractItemModel):
 		# Format data into displayable text
 		if index.column() == 1:
 			text = '0x%x' % conts['address']
+		elif index.column() == 2:
+			text = str(conts['hits'])
 		else:
 			text = str(conts['enabled'])
 		return text
@@ -104,7 +106,7 @@ class DebugBreakpointsItemDelegate(QItemDelegate):
 		self.char_height = QFontMetricsF(self.font).height()
 		self.char_offset = binaryninjaui.getFontVerticalOffset()
 
-		self.expected_char_widths = [10, 20]
+		self.expected_char_widths = [10, 20, 10]
 	
 	"""
 	virtual QSize sizeHint(const QStyleOptionViewItem& option, const QModelIndex& idx) const override;
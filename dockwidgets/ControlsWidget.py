@@ -247,6 +247,8 @@ class DebugControlsWidget(QToolBar):
 		# clear breakpoints
 		debug_state.breakpoint_tag_del()
 		debug_state.breakpoints = {}
+		debug_state.logpoints = {}
+		debug_state.breakpoint_hits_reset()
 
 		debug_state.state = 'INACTIVE'
 		self.editStatus.setText(msg or debug_state.state)
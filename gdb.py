@@ -5,13 +5,18 @@ import re
 import shutil
 import socket
 import subprocess
-from struct import pack, unpack
+from struct import pack, unpack, unpack_from, iter_unpack
 
 from . import rsp
 from . import utils
 from . import gdblike
 from . import DebugAdapter
 
+# /proc/<pid>/auxv entry holding the dynamic linker's load address
+AT_BASE = 7
+# ELF section holding the dynamic symbol table
+SHT_DYNSYM = 11
+
 linux_signal_to_name = {
 	# ISO C99
 	2: 'SIGINT',
@@ -94,11 +99,98 @@ linux_signal_to_debugadapter_reason = {
 	31: DebugAdapter.STOP_REASON.SIGNAL_SYS
 }
 
+# module path -> lowest address it's mapped at, for a local process
+def mem_modules_from_maps(pid):
+	module2addr = {}
+
+	with open('/proc/%d/maps' % pid, 'r') as fp:
+		lines = fp.readlines()
+
+	for line in lines:
+		line = line.strip()
+		m = re.match(r'^([0-9a-f]+)-[0-9a-f]+ [rwxp-]{4} .* (/.*)$', line)
+		if not m: continue
+		(addr, module) = m.group(1,2)
+		if module in module2addr: continue
+		if os.path.exists(module):
+			module2addr[module] = int(addr, 16)
+
+	return module2addr
+
+# mapped (start, end, permissions) of a local process
+def mem_regions_from_maps(pid):
+	regions = []
+
+	with open('/proc/%d/maps' % pid, 'r') as fp:
+		lines = fp.readlines()
+
+	for line in lines:
+		m = re.match(r'^([0-9a-f]+)-([0-9a-f]+) ([rwxp-]{4}) ', line)
+		if not m: continue
+		(start, end, perms) = m.group(1,2,3)
+		regions.append((int(start, 16), int(end, 16), perms[0:3].replace('-', '')))
+
+	return regions
+
+# value of a symbol in the dynamic symbol table of a 64-bit ELF file, or None
+def elf_dynsym_value(fpath, name):
+	with open(fpath, 'rb') as fp:
+		data = fp.read()
+	if data[0:4] != b'\x7FELF' or data[4] != 2:
+		return None
+	endian = '<' if data[5] == 1 else '>'
+
+	(e_shoff,) = unpack_from(endian+'Q', data, 0x28)
+	(e_shentsize, e_shnum) = unpack_from(endian+'HH', data, 0x3A)
+	# (sh_name, sh_type, sh_flags, sh_addr, sh_offset, sh_size, sh_link, ...)
+	sections = [unpack_from(endian+'IIQQQQIIQQ', data, e_shoff + i*e_shentsize) for i in range(e_shnum)]
+
+	for section in sections:
+		if section[1] != SHT_DYNSYM:
+			continue
+		strtab = sections[section[6]][4]
+		for offset in range(section[4], section[4] + section[5], section[9]):
+			(st_name, st_info, st_other, st_shndx, st_value, st_size) = unpack_from(endian+'IBBHQQ', data, offset)
+			end = data.index(b'\x00', strtab + st_name)
+			if data[strtab+st_name:end] == name.encode() and st_shndx:
+				return st_value
+
+	return None
+
+# address of the dynamic linker's _dl_debug_state() in a local process, it's
+# called each time the list of loaded libraries changes (see <link.h>)
+#
+# None when there's no dynamic linker (static executable)
+def dl_debug_state_from_proc(pid):
+	with open('/proc/%d/auxv' % pid, 'rb') as fp:
+		auxv = dict(iter_unpack('<QQ', fp.read()))
+
+	# the dynamic linker's load address
+	base = auxv.get(AT_BASE)
+	if not base:
+		return None
+
+	for (module, addr) in mem_modules_from_maps(pid).items():
+		if addr == base:
+			offset = elf_dynsym_value(module, '_dl_debug_state')
+			return None if offset == None else base + offset
+
+	return None
+
 class DebugAdapterGdb(gdblike.DebugAdapterGdbLike):
 	def __init__(self, **kwargs):
 		gdblike.DebugAdapterGdbLike.__init__(self, **kwargs)
 		self.os_sig_to_reason = linux_signal_to_debugadapter_reason
 
+		# opt-in: access memory of the inferior (local, we spawn gdbserver)
+		# through /proc/<pid>/mem instead of RSP
+		self.local_mem = kwargs.get('local_mem', False)
+		self.pid = None
+
+		# how to reach the gdbserver we spawn: 'tcp' on a free localhost port,
+		# or over its stdin/stdout as a 'unix' domain socket pair or a 'pipe'
+		self.transport = kwargs.get('transport', 'tcp')
+
 	#--------------------------------------------------------------------------
 	# API
 	#--------------------------------------------------------------------------
@@ -109,48 +201,129 @@ class DebugAdapterGdb(gdblike.DebugAdapterGdbLike):
 		if not os.path.exists(path_gdbserver):
 			raise Exception('cannot locate gdbserver')
 
-		# get available port
-		port = gdblike.get_available_port()
-		if port == None:
-			raise Exception('no available ports')
+		self.stub_path = path_gdbserver
+
+		if self.transport == 'tcp':
+			# get available port
+			port = gdblike.get_available_port()
+			if port == None:
+				raise Exception('no available ports')
+			comm = 'localhost:%d' % port
+		elif self.transport in ['unix', 'pipe']:
+			# gdbserver speaks RSP on its stdin/stdout (and redirects the
+			# inferior's stdout to stderr)
+			comm = '-'
+		else:
+			raise Exception('unknown transport: %s' % self.transport)
+
+		# the stub's end of a unix domain socket pair is its stdin and stdout
+		stub_io = subprocess.PIPE
+		if self.transport == 'unix':
+			(sock, stub_io) = socket.socketpair()
 
 		# invoke gdbserver
-		dbg_args = [path_gdbserver, '--once', '--no-startup-with-shell', 'localhost:%d'%port, path, '--']
+		dbg_args = [path_gdbserver, '--once', '--no-startup-with-shell', comm, path, '--']
 		dbg_args.extend(args)
 		print(' '.join(dbg_args))
 		try:
-			subprocess.Popen(dbg_args, stdin=None, stdout=None, stderr=None, preexec_fn=gdblike.preexec)
+			if self.transport == 'tcp':
+				self.stub_proc = subprocess.Popen(dbg_args, stdin=None, stdout=None, stderr=None, preexec_fn=gdblike.preexec)
+			else:
+				self.stub_proc = subprocess.Popen(dbg_args, stdin=stub_io, stdout=stub_io, stderr=None, bufsize=0, preexec_fn=gdblike.preexec)
 		except Exception:
 			raise Exception('invoking gdbserver (used path: %s)' % path_gdbserver)
 
 		# connect to gdbserver
-		self.sock = gdblike.connect('localhost', port)
+		if self.transport == 'tcp':
+			self.conn = rsp.RspConnection(gdblike.connect('localhost', port, proc=self.stub_proc))
+		elif self.transport == 'unix':
+			stub_io.close()
+			self.conn = rsp.RspConnection(sock)
+		else:
+			self.conn = rsp.RspPipeConnection(self.stub_proc.stdout, self.stub_proc.stdin)
 
 		# initial commands
-		rsp.tx_rx(self.sock, 'Hg0')
+		rsp.tx_rx(self.conn, 'Hg0')
 		# if 'multiprocess+' in list here, thread reply is like 'pX.Y' where X is core id, Y is thread id
-		rsp.tx_rx(self.sock, 'qSupported:swbreak+;hwbreak+;qRelocInsn+;fork-events+;vfork-events+;exec-events+;vContSupported+;QThreadEvents+;no-resumed+;xmlRegisters=i386')
+		self.features_load('qSupported:swbreak+;hwbreak+;qRelocInsn+;fork-events+;vfork-events+;exec-events+;vContSupported+;QThreadEvents+;no-resumed+;xmlRegisters=i386')
+		if self.features.get('QStartNoAckMode'):
+			self.no_ack_mode_start()
 		self.reg_info_load()
+		self.mem_binary_probe()
 
 		# acquire pid as first tid
-		reply = rsp.tx_rx(self.sock, '?')
-		tdict = rsp.packet_T_to_dict(reply)
-		self.tid = tdict['thread']
+		reply = rsp.tx_rx(self.conn, '?')
+		tdict = rsp.packet_T_to_dict(reply, self.reg_id_to_name)
+		self.stop_context_apply(tdict)
 		self.pid = self.tid
 
+		# library loads and unloads stop (and resume) at the dynamic linker,
+		# see modules_changed()
+		try:
+			self.library_breakpoint_set(dl_debug_state_from_proc(self.pid))
+		except Exception:
+			# unreadable /proc or ELF, library changes go unnoticed
+			pass
+
+	# mem
+	def mem_read(self, address, length):
+		data = self.local_mem_access(address, length)
+		if data == None:
+			data = gdblike.DebugAdapterGdbLike.mem_read(self, address, length)
+		return data
+
+	def mem_write(self, address, data):
+		if self.local_mem_access(address, len(data), data) == None:
+			return gdblike.DebugAdapterGdbLike.mem_write(self, address, data)
+		return 0
+
+	def mem_compare(self, address, data):
+		current = self.local_mem_access(address, len(data))
+		if current == None:
+			return gdblike.DebugAdapterGdbLike.mem_compare(self, address, data)
+		return current == data
+
 	def mem_modules(self):
-		module2addr = {}
+		return mem_modules_from_maps(self.pid)
 
-		with open('/proc/%d/maps' % self.pid, 'r') as fp:
-			lines = fp.readlines()
+	def mem_regions(self):
+		return mem_regions_from_maps(self.pid)
 
-		for line in lines:
-			line = line.strip()
-			m = re.match(r'^([0-9a-f]+)-[0-9a-f]+ [rwxp-]{4} .* (/.*)$', line)
-			if not m: continue
-			(addr, module) = m.group(1,2)
-			if module in module2addr: continue
-			if os.path.exists(module):
-				module2addr[module] = int(addr, 16)
+	#--------------------------------------------------------------------------
+	# helpers, NOT part of the API
+	#--------------------------------------------------------------------------
+
+	# gdbserver runs the inferior on this machine, and it's stopped whenever
+	# we're called, so its memory can be accessed directly instead of as hex
+	# over the socket
+	#
+	# /proc/<pid>/mem (unlike process_vm_writev()) can write read-only mappings
+	# like .text, as 'M' can
+	#
+	# returns None whenever the caller should fall back to RSP
+	def local_mem_access(self, address, length, data=None):
+		if not self.local_mem or self.pid == None:
+			return None
+
+		# gdbserver's breakpoint bytes are in memory, only RSP hides them
+		if [a for a in list(self.breakpoints) + [self.library_breakpoint] if a != None and address <= a < address+length]:
+			return None
+
+		try:
+			fd = os.open('/proc/%d/mem' % self.pid, os.O_RDWR if data else os.O_RDONLY)
+		except OSError:
+			return None
+
+		try:
+			if data == None:
+				result = os.pread(fd, length, address)
+				if len(result) == length:
+					return result
+			elif os.pwrite(fd, data, address) == length:
+				return length
+		except (OSError, OverflowError):
+			pass
+		finally:
+			os.close(fd)
 
-		return module2addr
+		return None
@@ -3,11 +3,19 @@
 import os
 import re
 import sys
+import json
 import time
+import errno
+import select
 import socket
+import hashlib
+import tempfile
+import subprocess
 import xml.parsers.expat
+from struct import Struct
 
 from . import rsp
+from . import agentexpr
 from . import DebugAdapter
 
 #--------------------------------------------------------------------------
@@ -31,24 +39,154 @@ def get_available_port():
 			#print('returning port: %d' % port)
 			return port
 
-def connect(host, port):
-	sock = None
-
-	for tries in range(4):
-		try:
-			sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-			sock.connect(('localhost', port))
+# how long a freshly spawned stub gets to start listening
+CONNECT_TIMEOUT = 10
+
+# connect as soon as the stub listens: retry refused connects with a short
+# backoff, and give up early if the stub process (when given) exits
+def connect(host, port, timeout=CONNECT_TIMEOUT, proc=None):
+	deadline = time.time() + timeout
+	delay = .005
+
+	while 1:
+		sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		sock.setblocking(False)
+		err = sock.connect_ex((host, port))
+		if err == errno.EINPROGRESS:
+			(_, writable, _) = select.select([], [sock], [], max(0, deadline - time.time()))
+			err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) if writable else errno.ETIMEDOUT
+		if err == 0:
+			sock.setblocking(True)
 			return sock
-
-		except ConnectionRefusedError:
-			# allow quarter second for debugserver to start listening
-			time.sleep(.25)
-
-	raise ConnectionRefusedError
+		sock.close()
+
+		if proc and proc.poll() != None:
+			raise ConnectionRefusedError('stub exited (status %d) before accepting a connection' % proc.returncode)
+		if time.time() + delay > deadline:
+			raise ConnectionRefusedError('connecting to %s:%d: %s' % (host, port, os.strerror(err)))
+		time.sleep(delay)
+		delay = min(2*delay, .025)
+
+# how long a stub gets to exit after we quit or detach
+STUB_EXIT_TIMEOUT = 5
+
+# reap a stub we spawned, so the session is really over when we return (the
+# inferior and its port are gone) instead of some time later
+def stub_wait(proc):
+	try:
+		proc.wait(STUB_EXIT_TIMEOUT)
+	except subprocess.TimeoutExpired:
+		proc.kill()
+		proc.wait()
+
+# watchpoint kind -> Z packet type
+watch_kind_to_z = {'execute': 1, 'write': 2, 'read': 3, 'access': 4}
+
+# T packet key -> stop reason
+watch_key_to_reason = {
+	'watch': DebugAdapter.STOP_REASON.WATCHPOINT_WRITE,
+	'rwatch': DebugAdapter.STOP_REASON.WATCHPOINT_READ,
+	'awatch': DebugAdapter.STOP_REASON.WATCHPOINT_ACCESS
+}
+
+# bytes of a packet not counted by its payload: '$', '#xx', a reply prefix
+PACKET_OVERHEAD = 16
 
 def preexec():
     os.setpgrp()
 
+# register info learned from a stub is cached on disk, one file per stub identity
+def layout_cache_fpath(identity):
+	cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+	digest = hashlib.sha1(json.dumps(identity, sort_keys=True).encode('utf-8')).hexdigest()
+	return os.path.join(cache_dir, 'binja_debugger', 'reg_info_%s.json' % digest)
+
+def layout_cache_load(identity):
+	try:
+		with open(layout_cache_fpath(identity), 'r') as fp:
+			entry = json.load(fp)
+	except (OSError, ValueError):
+		return None
+	if not isinstance(entry, dict):
+		return None
+	return entry
+
+# written aside then renamed over, sessions running concurrently read either
+# the old entry or the new one, never a partial write
+def layout_cache_store(identity, entry):
+	fpath = layout_cache_fpath(identity)
+	tmp = None
+	try:
+		os.makedirs(os.path.dirname(fpath), exist_ok=True)
+		(fd, tmp) = tempfile.mkstemp(dir=os.path.dirname(fpath), prefix='.reg_info_')
+		with os.fdopen(fd, 'w') as fp:
+			json.dump(entry, fp)
+		os.replace(tmp, fpath)
+	except OSError:
+		if tmp and os.path.exists(tmp):
+			os.remove(tmp)
+
+# layout of the registers blob returned by the 'g' packet, compiled once so a
+# reply decodes in a single pass
+#
+# registers of 8/16/32/64 bits unpack with one Struct, anything else (vector,
+# x87) is left as a memoryview and only converted to int when read
+class RegisterLayout:
+	def __init__(self, reg_info):
+		# registers are laid out in id order, until a gap in the ids
+		id2name = {reg_info[k]['id']: k for k in reg_info}
+		self.entries = [] # (name, byte offset, byte width)
+		offset = 0
+		for id_ in range(len(id2name)):
+			name = id2name.get(id_)
+			if name == None or not reg_info[name]['width']:
+				break
+			width = reg_info[name]['width'] // 8
+			self.entries.append((name, offset, width))
+			offset += width
+
+		fmt = '<'
+		position = 0
+		self.scalars = []
+		self.vectors = []
+		for (name, offset, width) in self.entries:
+			code = {1:'B', 2:'H', 4:'I', 8:'Q'}.get(width)
+			if code == None:
+				self.vectors.append((name, offset, width))
+				continue
+			if offset > position:
+				fmt += '%dx' % (offset - position)
+			fmt += code
+			position = offset + width
+			self.scalars.append(name)
+		self.struct = Struct(fmt)
+
+	def decode(self, reply):
+		# unavailable registers are sent as 'xx..', decode what we can around them
+		if 'x' in reply:
+			return self.decode_slow(reply)
+		blob = bytes.fromhex(reply)
+		if len(blob) < self.struct.size:
+			return self.decode_slow(reply)
+
+		result = dict(zip(self.scalars, self.struct.unpack_from(blob)))
+		view = memoryview(blob)
+		for (name, offset, width) in self.vectors:
+			if offset + width <= len(blob):
+				result[name] = view[offset:offset+width]
+		return result
+
+	def decode_slow(self, reply):
+		result = {}
+		for (name, offset, width) in self.entries:
+			valstr = reply[2*offset:2*(offset+width)]
+			if len(valstr) < 2*width:
+				break
+			if 'x' in valstr:
+				continue
+			result[name] = int.from_bytes(bytes.fromhex(valstr), 'little')
+		return result
+
 #--------------------------------------------------------------------------
 # CLASS FOR GDB-LIKE ADAPTERS
 #--------------------------------------------------------------------------
@@ -60,6 +198,8 @@ class DebugAdapterGdbLike(DebugAdapter.DebugAdapter):
 		# register info
 		self.reg_info = {} # eg: 'rip' -> {'id':8, 'width':64}
 		self.reg_cache = {} # eg: 'rip' -> 0x400400
+		self.reg_id_to_name = {} # eg: 8 -> 'rip'
+		self.reg_layout = None # RegisterLayout of the 'g' blob
 
 		# address -> True
 		self.breakpoints = {}
@@ -67,6 +207,25 @@ class DebugAdapterGdbLike(DebugAdapter.DebugAdapter):
 		# client tracks selected thread
 		self.tid = None
 
+		# stub features from qSupported, eg: 'PacketSize' -> 0x3fff
+		self.features = {}
+
+		# path to the gdbserver/debugserver we launched, if any
+		self.stub_path = None
+		# the stub process, when we spawned it
+		self.stub_proc = None
+
+		# vCont actions, learned by vcont_actions()
+		self.vcont = None
+
+		# (address, size, kind) -> True
+		self.watchpoints = {}
+
+		# binary memory transfer, learned by mem_binary_probe()
+		self.mem_read_prefix = None # None: use 'm', else 'x' reply prefix
+		self.mem_write_binary = False # use 'X' instead of 'M'
+		self.mem_crc = True # stub answers 'qCRC', until it doesn't
+
 	#--------------------------------------------------------------------------
 	# API
 	#--------------------------------------------------------------------------
@@ -74,26 +233,30 @@ class DebugAdapterGdbLike(DebugAdapter.DebugAdapter):
 	# session start/stop
 	def detach(self):
 		try:
-			rsp.send_packet_data(self.sock, 'D')
-			self.sock.shutdown(socket.SHUT_RDWR)
-			self.sock.close()
-			self.sock = None
+			rsp.send_packet_data(self.conn, 'D')
+			self.conn.close()
+			self.conn = None
 		except rsp.RspDisconnected:
 			pass
+		if self.stub_proc != None:
+			stub_wait(self.stub_proc)
+			self.stub_proc = None
 
 	def quit(self):
 		try:
-			rsp.send_packet_data(self.sock, 'k')
-			self.sock.shutdown(socket.SHUT_RDWR)
-			self.sock.close()
-			self.sock = None
+			rsp.send_packet_data(self.conn, 'k')
+			self.conn.close()
+			self.conn = None
 		except rsp.RspDisconnected:
 			pass
+		if self.stub_proc != None:
+			stub_wait(self.stub_proc)
+			self.stub_proc = None
 
 	# threads
 	def thread_list(self):
 		result = []
-		reply = rsp.tx_rx(self.sock, 'qfThreadInfo')
+		reply = rsp.tx_rx(self.conn, 'qfThreadInfo')
 		while 1:
 			if reply == 'l': break
 			if not reply.startswith('m'):
@@ -101,7 +264,7 @@ class DebugAdapterGdbLike(DebugAdapter.DebugAdapter):
 			tids = reply[1:].split(',')
 			tids = list(map(lambda x: int(x,16), tids))
 			result += tids
-			reply = rsp.tx_rx(self.sock, 'qsThreadInfo')
+			reply = rsp.tx_rx(self.conn, 'qsThreadInfo')
 
 		return result
 
@@ -109,40 +272,52 @@ class DebugAdapterGdbLike(DebugAdapter.DebugAdapter):
 		if self.tid == None:
 			raise DebugAdapter.GeneralError('no tid set by last stop or thread switch')
 
-		if rsp.tx_rx(self.sock, 'T%X'%self.tid) != 'OK':
+		if rsp.tx_rx(self.conn, 'T%X'%self.tid) != 'OK':
 			self.tid == None
 
 		return self.tid
 
 	def thread_select(self, tid):
-		if rsp.tx_rx(self.sock, 'T%X'%self.tid) != 'OK':
+		if rsp.tx_rx(self.conn, 'T%X'%self.tid) != 'OK':
 			raise DebugAdapter.GeneralError("tid 0x%X is not alive" % tid)
 
 		self.reg_cache = {}
 
 		# set thread for step and continue operations
 		payload = 'Hc%x' % tid
-		if rsp.tx_rx(self.sock, payload) != 'OK':
+		if rsp.tx_rx(self.conn, payload) != 'OK':
 			raise DebugAdapter.GeneralError('setting tid 0x%X for step and continue' % tid)
 
 		# set thread for other operations
 		payload = 'Hg%x' % tid
-		if rsp.tx_rx(self.sock, payload) != 'OK':
+		if rsp.tx_rx(self.conn, payload) != 'OK':
 			raise DebugAdapter.GeneralError('setting tid 0x%X for other operations' % tid)
 
 		#
 		self.tid = tid
 
 	# breakpoints
-	def breakpoint_set(self, addr):
+	# condition (see agentexpr) is evaluated by the stub when it supports
+	# ConditionalBreakpoints, else by go() at each hit
+	def breakpoint_set(self, addr, condition=None):
 		if addr in self.breakpoints:
 			raise DebugAdapter.BreakpointSetError("breakpoint set at 0x%X already exists" % addr)
 
 		data = 'Z0,%x,1' % addr
-		reply = rsp.tx_rx(self.sock, data)
+		code = None
+		if condition:
+			regs = {name: self.reg_info[name]['id'] for name in self.reg_info}
+			code = agentexpr.compile_expr(condition, regs)
+			if self.features.get('ConditionalBreakpoints'):
+				data += ';X%x,%s' % (len(code), code.hex())
+				code = None
+
+		reply = rsp.tx_rx(self.conn, data)
 		if reply != 'OK':
 			raise DebugAdapter.BreakpointSetError('rsp replied: %s' % reply)
 		self.breakpoints[addr] = True
+		if code:
+			self.breakpoint_conditions[addr] = code
 		return 0
 
 	def breakpoint_clear(self, addr):
@@ -150,16 +325,88 @@ class DebugAdapterGdbLike(DebugAdapter.DebugAdapter):
 			raise DebugAdapter.BreakpointClearError("breakpoint clear at 0x%X doesn't exist" % addr)
 
 		data = 'z0,%x,1' % addr
-		reply = rsp.tx_rx(self.sock, data)
+		# the library breakpoint stays, without the user's condition
+		if addr == self.library_breakpoint:
+			data = 'Z0,%x,1' % addr
+		reply = rsp.tx_rx(self.conn, data)
 		if reply != 'OK':
 			raise DebugAdapter.BreakpointClearError("rsp replied: %s" % reply)
 
 		del self.breakpoints[addr]
+		self.breakpoint_conditions.pop(addr, None)
 		return 0
 
 	def breakpoint_list(self):
 		return self.breakpoints
 
+	# the Z/z packets are pipelined, one round trip for the lot
+	def breakpoint_set_many(self, addresses):
+		result = {}
+		todo = []
+		for addr in addresses:
+			if addr in self.breakpoints or addr in result:
+				result[addr] = DebugAdapter.BreakpointSetError("breakpoint set at 0x%X already exists" % addr)
+			else:
+				result[addr] = None
+				todo.append(addr)
+
+		replies = rsp.tx_rx_many(self.conn, ['Z0,%x,1' % addr for addr in todo])
+		for (addr, reply) in zip(todo, replies):
+			if reply == 'OK':
+				self.breakpoints[addr] = True
+			else:
+				result[addr] = DebugAdapter.BreakpointSetError('rsp replied: %s' % reply)
+
+		return result
+
+	def breakpoint_clear_many(self, addresses):
+		result = {}
+		todo = []
+		for addr in addresses:
+			if not addr in self.breakpoints or addr in result:
+				result[addr] = DebugAdapter.BreakpointClearError("breakpoint clear at 0x%X doesn't exist" % addr)
+			else:
+				result[addr] = None
+				todo.append(addr)
+
+		replies = rsp.tx_rx_many(self.conn, [('Z0,%x,1' if addr == self.library_breakpoint else 'z0,%x,1') % addr for addr in todo])
+		for (addr, reply) in zip(todo, replies):
+			if reply == 'OK':
+				del self.breakpoints[addr]
+				self.breakpoint_conditions.pop(addr, None)
+			else:
+				result[addr] = DebugAdapter.BreakpointClearError('rsp replied: %s' % reply)
+
+		return result
+
+	# hardware breakpoints and watchpoints
+	def watchpoint_set(self, address, size, kind):
+		if not kind in watch_kind_to_z:
+			raise DebugAdapter.GeneralError('unknown watchpoint kind: %s' % kind)
+		if (address, size, kind) in self.watchpoints:
+			raise DebugAdapter.BreakpointSetError('%s watchpoint at 0x%X already exists' % (kind, address))
+
+		reply = rsp.tx_rx(self.conn, 'Z%d,%x,%x' % (watch_kind_to_z[kind], address, size))
+		if reply == '':
+			raise DebugAdapter.BreakpointSetError('stub doesn\'t support %s watchpoints' % kind)
+		if reply != 'OK':
+			raise DebugAdapter.BreakpointSetError('rsp replied: %s' % reply)
+		self.watchpoints[(address, size, kind)] = True
+		return 0
+
+	def watchpoint_clear(self, address, size, kind):
+		if not (address, size, kind) in self.watchpoints:
+			raise DebugAdapter.BreakpointClearError("%s watchpoint at 0x%X doesn't exist" % (kind, address))
+
+		reply = rsp.tx_rx(self.conn, 'z%d,%x,%x' % (watch_kind_to_z[kind], address, size))
+		if reply != 'OK':
+			raise DebugAdapter.BreakpointClearError('rsp replied: %s' % reply)
+		del self.watchpoints[(address, size, kind)]
+		return 0
+
+	def watchpoint_list(self):
+		return list(self.watchpoints)
+
 	# register
 	def reg_read(self, name):
 		if not name in self.reg_info:
@@ -167,18 +414,18 @@ class DebugAdapterGdbLike(DebugAdapter.DebugAdapter):
 
 		if name in self.reg_cache:
 			#print('RETURNING CACHED VALUE! %s = 0x%X' % (name, self.reg_cache[name]))
-			return self.reg_cache[name]
+			return self.reg_cache_get(name)
 
 		# do a general purpose register query
 		tmp = self.general_read_registers()
 		if not name in tmp:
 			raise DebugAdapter.GeneralError("requested register %s doesnt exist" % name)
 		self.reg_cache.update(tmp)
-		return self.reg_cache[name]
+		return self.reg_cache_get(name)
 
 		# see if gdb will respond to a single register query
 		#id_ = self.reg_info[name]['id']
-		#reply = rsp.tx_rx(self.sock, 'p%02x' % id_)
+		#reply = rsp.tx_rx(self.conn, 'p%02x' % id_)
 		#if reply != '':
 		#	val = int(''.join(reversed([reply[i:i+2] for i in range(0,len(reply),2)])), 16)
 		#	self.reg_cache[name] = val # cache result
@@ -188,29 +435,31 @@ class DebugAdapterGdbLike(DebugAdapter.DebugAdapter):
 		if not name in self.reg_info:
 			raise DebugAdapter.GeneralError("requested register %s doesnt exist" % name)
 
-		del self.reg_cache[name]
+		self.reg_cache.pop(name, None)
 
+		# like the register, a value wraps at its width (eg: -1 is all ones)
 		width = self.reg_info[name]['width']
-		fmtstrs = {8:'%02X', 16:'%04X', 32:'%08X', 64:'%016X'}
-		valstr = fmtstrs[width] % value
-		valstr = [valstr[i:i+2] for i in range(0,len(valstr),2)]
-		valstr = ''.join(reversed(valstr))
+		value &= (1 << width) - 1
+		valstr = value.to_bytes(width//8, 'little').hex().upper()
 
 		# see if gdb will respond to a single register set
 		payload = 'P%d=%s' % (self.reg_info[name]['id'], valstr)
-		reply = rsp.tx_rx(self.sock, payload)
+		reply = rsp.tx_rx(self.conn, payload)
 		if reply != '':
 			return
 
 		# otherwise, do a general purpose register query, followed by a set
-		blob = rsp.tx_rx(self.sock, 'g')
+		blob = rsp.tx_rx(self.conn, 'g')
 		offset = self.reg_info[name].get('offset')
 		if offset == None:
 			raise DebugAdapter.GeneralError('requested register %s doesnt have offset' % name)
 		a = 2*(offset//8)
 		b = 2*((offset+width)//8)
 		payload = 'G'+blob[0:a]+valstr+blob[b:]
-		reply = rsp.tx_rx(self.sock, payload)
+		packet_size = self.features.get('PacketSize')
+		if packet_size and len(payload) + PACKET_OVERHEAD > packet_size:
+			raise DebugAdapter.GeneralError('setting register %s needs a packet larger than the stub accepts' % name)
+		reply = rsp.tx_rx(self.conn, payload)
 		if reply != 'OK':
 			raise DebugAdapter.GeneralError('setting register %s' % name)
 
@@ -224,50 +473,94 @@ class DebugAdapterGdbLike(DebugAdapter.DebugAdapter):
 
 	# mem
 	def mem_read(self, address, length):
-		result = b''
-		while(length):
-			sz = min(length, 1024) # safely below ethernet MTU 1024
-			reply = rsp.tx_rx(self.sock, 'm%x,%x' % (address, sz))
-			if reply.startswith('E'):
-				raise DebugAdapter.GeneralError('reading from address 0x%X' % address)
-			result += bytes.fromhex(reply)
-			length -= sz
-		return result
+		result = bytearray(length)
+
+		# one request per chunk, all pipelined, the replies arriving in order
+		chunk = self.mem_chunk_size()
+		requests = [(offs, min(chunk, length-offs)) for offs in range(0, length, chunk)]
+		packets = [self.mem_read_packet(address+offs, sz) for (offs, sz) in requests]
+		replies = rsp.tx_rx_many(self.conn, packets, decode=(self.mem_read_prefix == None))
+
+		# every reply must be drained before raising, to keep the stream in sync
+		error = None
+		short = []
+		for ((offs, sz), reply) in zip(requests, replies):
+			try:
+				data = self.mem_read_decode(reply, address+offs)
+			except DebugAdapter.GeneralError as e:
+				error = error or e
+				continue
+			result[offs:offs+len(data)] = data
+			if len(data) < sz:
+				short.append((offs+len(data), sz-len(data)))
+		if error:
+			raise error
+
+		# stubs may return less than asked (eg: when escaped data doesn't fit)
+		for (offs, sz) in short:
+			result[offs:offs+sz] = self.mem_read(address+offs, sz)
+
+		return bytes(result)
 
 	def mem_write(self, address, data):
-		payload = 'M%X,%X:%s' % (address, len(data), ''.join(['%02X'%b for b in data]))
-		reply = rsp.tx_rx(self.sock, payload)
+		if self.mem_write_binary:
+			payload = b'X%x,%x:' % (address, len(data)) + rsp.binary_encode(data)
+		else:
+			payload = 'M%X,%X:%s' % (address, len(data), ''.join(['%02X'%b for b in data]))
+		reply = rsp.tx_rx(self.conn, payload)
 		if reply != 'OK':
 			raise DebugAdapter.GeneralError('writing to address 0x%X' % address)
-			return 0
+		return 0
+
+	# the stub checksums the range, only the CRC crosses the wire
+	def mem_compare(self, address, data):
+		if not self.mem_crc:
+			raise NotImplementedError('qCRC')
+		reply = rsp.tx_rx(self.conn, 'qCRC:%x,%x' % (address, len(data)))
+		if reply == '':
+			self.mem_crc = False
+			raise NotImplementedError('qCRC')
+		if not reply.startswith('C'):
+			raise DebugAdapter.GeneralError('checksumming address 0x%X' % address)
+		return int(reply[1:], 16) == rsp.crc32(data)
 
 	def mem_modules(self):
 		raise NotImplementedError('mem_modules()')
 
 	# break
 	def break_into(self):
-		rsp.send_raw(self.sock, '\x03')
+		rsp.send_raw(self.conn, '\x03')
 		# TODO: detect error
 		return True
 
 	def break_reason(self):
-		pkt_T = rsp.tx_rx(self.sock, '?')
+		pkt_T = rsp.tx_rx(self.conn, '?')
 		#print(pkt_T)
 
 	# execution control, all return:
 	# returns (STOP_REASON.XXX, <extra_info>)
 	def go(self):
-		self.reg_cache = {}
-		#return self.go_generic('c', self.handler_async_pkt)
-		rc = self.go_generic('vCont;c:-1', self.handler_async_pkt)
-		self.set_thread_after_stop()
-		return rc
+		while 1:
+			self.reg_cache = {}
+			#(reason, data) = self.go_generic('c', self.handler_async_pkt)
+			(reason, data) = self.go_generic('vCont;c:-1', self.handler_async_pkt)
+			if not self.library_event_at_stop(reason) and not self.condition_false_at_stop(reason):
+				return (reason, data)
 
 	def step_into(self):
+		gotype = self.vcont_step()
 		self.reg_cache = {}
-		rc = self.go_generic('vCont;s', self.handler_async_pkt)
-		self.set_thread_after_stop()
-		return rc
+		return self.go_generic(gotype, self.handler_async_pkt)
+
+	# the stub steps the range itself when it supports vCont;r
+	def step_range(self, start, end):
+		if not 'r' in self.vcont_actions():
+			return DebugAdapter.DebugAdapter.step_range(self, start, end)
+		self.reg_cache = {}
+		payload = 'vCont;r%x,%x' % (start, end)
+		if self.tid != None:
+			payload += ':%x' % self.tid
+		return self.go_generic(payload, self.handler_async_pkt)
 
 	def step_over(self):
 		# gdb, lldb just doesn't have this, you must synthesize it yourself
@@ -278,38 +571,122 @@ class DebugAdapterGdbLike(DebugAdapter.DebugAdapter):
 	#--------------------------------------------------------------------------
 	# helpers, NOT part of the API
 	#--------------------------------------------------------------------------
+
+	def library_breakpoint_insert(self, addr):
+		reply = rsp.tx_rx(self.conn, 'Z0,%x,1' % addr)
+		if reply != 'OK':
+			raise DebugAdapter.BreakpointSetError('rsp replied: %s' % reply)
+
+	def reg_name_from_id(self, rid):
+		return self.reg_id_to_name[rid]
+
 	def general_read_registers(self):
-		result = {}
+		reply = rsp.tx_rx(self.conn, 'g')
+		return self.reg_layout.decode(reply)
+
+	# wide registers are cached undecoded (see RegisterLayout), convert on demand
+	def reg_cache_get(self, name):
+		val = self.reg_cache[name]
+		if isinstance(val, memoryview):
+			val = int.from_bytes(val, 'little')
+			self.reg_cache[name] = val
+		return val
+
+	# ask for the stub's features, see:
+	# https://sourceware.org/gdb/current/onlinedocs/gdb/General-Query-Packets.html#qSupported
+	def features_load(self, query='qSupported'):
+		reply = rsp.tx_rx(self.conn, query)
+		self.features = rsp.packet_qSupported_to_dict(reply)
+
+	# largest memory request whose reply fits in a stub's packet
+	def mem_chunk_size(self):
+		packet_size = self.features.get('PacketSize')
+		if not packet_size:
+			return 1024 # safely below ethernet MTU 1024
+
+		# hex doubles every byte, binary is only expanded by escapes (and a stub
+		# returns less than asked when those don't fit)
+		if self.mem_read_prefix == None:
+			return (packet_size - PACKET_OVERHEAD) // 2
+		return packet_size - PACKET_OVERHEAD
+
+	# stop sending and expecting '+' for every packet, if the stub allows it
+	def no_ack_mode_start(self):
+		reply = rsp.tx_rx(self.conn, 'QStartNoAckMode')
+		if reply == 'OK':
+			self.conn.acks = False
+		return not self.conn.acks
+
+	# learn whether the stub speaks binary memory transfer ('x' and 'X')
+	def mem_binary_probe(self):
+		# gdbserver replies 'b<data>', debugserver replies 'OK' (raw data), else unsupported
+		if self.features.get('binary-upload'):
+			reply = b'b'
+		else:
+			reply = rsp.tx_rx(self.conn, 'x0,0', decode=False)
+		if reply.startswith(b'b'):
+			self.mem_read_prefix = b'b'
+		elif reply == b'OK':
+			self.mem_read_prefix = b''
+		else:
+			self.mem_read_prefix = None
 
-		id2reg = {self.reg_info[k]['id']: k for k in self.reg_info.keys()}
-		reply = rsp.tx_rx(self.sock, 'g')
-		for id_ in range(max(id2reg.keys())+1):
-			reg = id2reg.get(id_)
-			if reg == None: break
-			width = self.reg_info[reg]['width']
-			nchars = 2*(width//8)
-			valstr = reply[0:nchars]
-			valstr = ''.join(reversed([valstr[i:i+2] for i in range(0,len(valstr),2)]))
-			result[reg] = int(valstr, 16)
-			reply = reply[nchars:]
-			if not reply: break
+		self.mem_write_binary = (rsp.tx_rx(self.conn, 'X0,0:') == 'OK')
 
-		return result
+	# memory read request, using 'x' when possible, else 'm'
+	def mem_read_packet(self, address, length):
+		if self.mem_read_prefix == None:
+			return 'm%x,%x' % (address, length)
+		return 'x%x,%x' % (address, length)
+
+	# memory read reply -> bytes
+	def mem_read_decode(self, reply, address):
+		if self.mem_read_prefix == None:
+			if not reply or reply.startswith('E'):
+				raise DebugAdapter.GeneralError('reading from address 0x%X' % address)
+			return bytes.fromhex(reply)
+
+		if not reply.startswith(self.mem_read_prefix) or re.match(rb'^E[0-9a-fA-F]{2}$', reply):
+			raise DebugAdapter.GeneralError('reading from address 0x%X' % address)
+		data = rsp.binary_decode(reply[len(self.mem_read_prefix):])
+		if not data:
+			raise DebugAdapter.GeneralError('reading from address 0x%X' % address)
+		return data
 
 	def set_thread_after_stop(self):
-		reply = rsp.tx_rx(self.sock, '?')
-		context = rsp.packet_T_to_dict(reply)
+		reply = rsp.tx_rx(self.conn, '?')
+		context = rsp.packet_T_to_dict(reply, self.reg_id_to_name)
 		if not 'thread' in context:
 			raise DebugAdapter.GeneralError('determing thread responsible for stop')
-		self.tid = context.get('thread')
+		self.stop_context_apply(context)
+
+	# a stop packet names the thread responsible and expedites some of its
+	# registers (typically pc, sp, fp), sparing the round trips to ask for them
+	def stop_context_apply(self, context):
+		if 'thread' in context:
+			self.tid = context['thread']
+		self.reg_cache = {k: v for (k, v) in context.items() if k in self.reg_info}
+
+	# stream a qXfer object from the stub, chunks sized to the stub's packets
+	def qxfer_read(self, obj, annex=''):
+		length = 0xfff
+		packet_size = self.features.get('PacketSize')
+		if packet_size:
+			length = packet_size - PACKET_OVERHEAD
+
+		try:
+			for data in rsp.qxfer_read(self.conn, obj, annex, length):
+				yield data
+		except rsp.RspGeneralError as e:
+			raise DebugAdapter.GeneralError('reading qXfer object %s %s: %s' % (obj, annex, e))
+
+	# whole qXfer object, eg: qxfer_read_all('auxv'), qxfer_read_all('libraries-svr4')
+	def qxfer_read_all(self, obj, annex=''):
+		return b''.join(self.qxfer_read(obj, annex))
 
 	def get_xml(self, fname):
 		#print('downloading %s' % fname)
-		data = rsp.tx_rx(self.sock, 'qXfer:features:read:%s:0,fff' % fname, 'ack_then_reply')
-		if not data[0] in ['l', 'm']:
-			raise DebugAdapter.GeneralError('acquiring register description xml')
-		data = rsp.un_rle(data[1:])
-		return data
+		return self.qxfer_read_all('features', fname).decode('utf-8')
 
 	# See G.2.7 Registers for what's going on here
 	# https://sourceware.org/gdb/current/onlinedocs/gdb/Target-Description-Format.html#Target-Description-Format
@@ -318,6 +695,22 @@ class DebugAdapterGdbLike(DebugAdapter.DebugAdapter):
 		if not force and self.reg_info:
 			return
 
+		xmltxt = self.get_xml('target.xml')
+
+		# target.xml names the architecture and includes the feature files, so
+		# if it's unchanged the registers cached for this stub are still good
+		identity = self.stub_identity()
+		xml_digest = hashlib.sha1(xmltxt.encode('utf-8')).hexdigest()
+		cached = layout_cache_load(identity)
+		if cached and cached.get('target.xml') == xml_digest:
+			try:
+				self.reg_info = cached['reg_info']
+				self.reg_info_finish()
+				return
+			except (KeyError, ValueError, TypeError, AttributeError):
+				# malformed (eg: edited, or an older format), ask the stub
+				pass
+
 		#
 		# collect subfiles included from target.xml
 		#
@@ -335,7 +728,6 @@ class DebugAdapterGdbLike(DebugAdapter.DebugAdapter):
 
 		p = xml.parsers.expat.ParserCreate()
 		p.StartElementHandler = search_include
-		xmltxt = self.get_xml('target.xml')
 		#print(xmltxt)
 		p.Parse(xmltxt)
 
@@ -365,11 +757,12 @@ class DebugAdapterGdbLike(DebugAdapter.DebugAdapter):
 
 		for fname in subfiles:
 			#print('acquiring %s' % fname)
-			xmltxt = self.get_xml(fname)
-			#print(xmltxt)
 			p = xml.parsers.expat.ParserCreate()
 			p.StartElementHandler = search_reg
-			p.Parse(xmltxt)
+			# parse as the chunks arrive
+			for data in self.qxfer_read('features', fname):
+				p.Parse(data, False)
+			p.Parse(b'', True)
 
 		#
 		# calculate bit offset per register within a concatenated registers blob
@@ -379,7 +772,7 @@ class DebugAdapterGdbLike(DebugAdapter.DebugAdapter):
 		id_max = max(id2width.keys())
 
 		offset = 0
-		for i in range(id_max):
+		for i in range(id_max+1):
 			if not i in id2width: # non-sequential id, can't know offset
 				break
 
@@ -387,25 +780,74 @@ class DebugAdapterGdbLike(DebugAdapter.DebugAdapter):
 			self.reg_info[name]['offset'] = offset
 			offset += id2width[i]
 
+		layout_cache_store(identity, {'target.xml': xml_digest, 'reg_info': self.reg_info})
+		self.reg_info_finish()
+
 		#for reg in sorted(self.reg_info, key=lambda x: self.reg_info[x]['id']):
 		#	print('%s id=%d width=%d' % (reg, self.reg_info[reg]['id'], self.reg_info[reg]['width']))
 
+	# derived lookups, from reg_info fresh or cached
+	def reg_info_finish(self):
+		self.reg_id_to_name = {self.reg_info[k]['id']: k for k in self.reg_info}
+		self.reg_layout = RegisterLayout(self.reg_info)
+
+	# what keys the on disk register cache: the stub binary and version, and
+	# what it reported in qSupported
+	def stub_identity(self):
+		version = None
+		if self.stub_path and os.path.exists(self.stub_path):
+			st = os.stat(self.stub_path)
+			version = [st.st_size, st.st_mtime]
+		return [self.stub_path, version, sorted(self.features.items())]
+
+	# actions the stub supports in vCont packets, eg: ['c', 'C', 's', 'S', 'r']
+	def vcont_actions(self):
+		if self.vcont == None:
+			reply = rsp.tx_rx(self.conn, 'vCont?')
+			self.vcont = reply.split(';')[1:] if reply.startswith('vCont') else []
+		return self.vcont
+
+	# single step the selected thread while the others continue (it may wait
+	# on them), only stepping off a breakpoint holds them back
+	def vcont_step(self):
+		if self.tid == None:
+			return 'vCont;s'
+		if self.reg_read(self.reg_name_pc()) in self.breakpoints:
+			return 'vCont;s:%x' % self.tid
+		return 'vCont;s:%x;c' % self.tid
+
 	# returns (STOP_REASON.XXX, <extra_info>)
 	def go_generic(self, gotype, handler_async_pkt=None):
 		try:
 			if handler_async_pkt is None:
 				handler_async_pkt = self.handler_async_pkt
-			reply = rsp.tx_rx(self.sock, gotype, 'mixed_output_ack_then_reply', handler_async_pkt)
+			reply = rsp.tx_rx(self.conn, gotype, 'mixed_output_ack_then_reply', handler_async_pkt)
 			(reason, reason_data) = (None, None)
 
 			# thread info
 			if reply[0] == 'T':
-				tdict = rsp.packet_T_to_dict(reply)
-				self.active_thread_tid = tdict['thread']
+				tdict = rsp.packet_T_to_dict(reply, self.reg_id_to_name)
+				if not 'thread' in tdict:
+					self.set_thread_after_stop()
+				else:
+					self.stop_context_apply(tdict)
+				self.active_thread_tid = self.tid
 				signum = tdict.get('signal', 0)
 				(reason, reason_data) = \
 					(self.os_sig_to_reason.get(signum, DebugAdapter.STOP_REASON.UNKNOWN), signum)
 
+				# watchpoint hit, the value is the data address
+				for (key, watch_reason) in watch_key_to_reason.items():
+					if key in tdict:
+						(reason, reason_data) = (watch_reason, int(tdict[key], 16))
+
+				# the stub saw libraries come or go, or the process exec'd (and
+				# the library breakpoint went with the old program)
+				if 'library' in tdict or 'exec' in tdict:
+					self.modules_dirty = True
+				if 'exec' in tdict:
+					self.library_breakpoint = None
+
 			# exit status
 			elif reply[0] == 'W':
 				exit_status = int(reply[1:], 16)
@@ -422,7 +864,7 @@ class DebugAdapterGdbLike(DebugAdapter.DebugAdapter):
 			return (DebugAdapter.BACKEND_DISCONNECTED, None)
 
 	def raw(self, data):
-		return rsp.tx_rx(self.sock, data)
+		return rsp.tx_rx(self.conn, data)
 
 	# asynchronously called when inside a "go" to inform us of stdout (and
 	# possibly other stuff)
@@ -107,6 +107,8 @@ class DebugAdapterLLDB(gdblike.DebugAdapterGdbLike):
 		if not os.path.exists(path_debugserver):
 			raise Exception('cannot locate debugserver')
 
+		self.stub_path = path_debugserver
+
 		# get available port
 		port = gdblike.get_available_port()
 		if port == None:
@@ -117,19 +119,24 @@ class DebugAdapterLLDB(gdblike.DebugAdapterGdbLike):
 		dbg_args.extend(args)
 		#print('args are: ', ' '.join(dbg_args))
 		try:
-			subprocess.Popen(dbg_args, stdin=None, stdout=None, stderr=None, preexec_fn=gdblike.preexec)
+			self.stub_proc = subprocess.Popen(dbg_args, stdin=None, stdout=None, stderr=None, preexec_fn=gdblike.preexec)
 		except Exception:
 			raise Exception('invoking debugserver (used path: %s)' % path_debugserver)
 
 		# connect to it
-		self.sock = gdblike.connect('localhost', port)
+		self.conn = rsp.RspConnection(gdblike.connect('localhost', port, proc=self.stub_proc))
+
+		# debugserver doesn't advertise it, but accepts QStartNoAckMode
+		self.no_ack_mode_start()
+		self.features_load('qSupported:xmlRegisters=i386')
 
 		# learn initial registers
 		self.reg_info_load()
+		self.mem_binary_probe()
 
 	# threads
 	def thread_list(self):
-		reply = rsp.tx_rx(self.sock, 'qfThreadInfo', 'ack_then_reply')
+		reply = rsp.tx_rx(self.conn, 'qfThreadInfo', 'ack_then_reply')
 		if not reply.startswith('m'):
 			raise DebugAdapter.GeneralError("retrieving thread list from server after qfThreadInfo packet")
 		tids = reply[1:].split(',')
@@ -137,7 +144,11 @@ class DebugAdapterLLDB(gdblike.DebugAdapterGdbLike):
 		return tids
 
 	def thread_selected(self):
-		reply = rsp.tx_rx(self.sock, '?', 'ack_then_reply')
+		# known from the last stop packet or thread switch
+		if self.tid != None:
+			return self.tid
+
+		reply = rsp.tx_rx(self.conn, '?', 'ack_then_reply')
 		context = rsp.packet_T_to_dict(reply)
 		if not 'thread' in context:
 			raise DebugAdapter.GeneralError("setting thread on server after '?' packet")
@@ -152,11 +163,13 @@ class DebugAdapterLLDB(gdblike.DebugAdapterGdbLike):
 
 		# set thread for step and continue operations
 		payload = 'Hc%x' % tid
-		reply = rsp.tx_rx(self.sock, payload, 'ack_then_ok')
+		reply = rsp.tx_rx(self.conn, payload, 'ack_then_ok')
 
 		# set thread for other operations
 		payload = 'Hg%x' % tid
-		reply = rsp.tx_rx(self.sock, payload, 'ack_then_ok')
+		reply = rsp.tx_rx(self.conn, payload, 'ack_then_ok')
+
+		self.tid = tid
 
 	# breakpoints
 	#def breakpoint_set(self, addr):
@@ -175,12 +188,33 @@ class DebugAdapterLLDB(gdblike.DebugAdapterGdbLike):
 
 	def mem_modules(self):
 		module2addr = {}
-		reply = rsp.tx_rx(self.sock, 'jGetLoadedDynamicLibrariesInfos:{"fetch_all_solibs":true}')
+		reply = rsp.tx_rx(self.conn, 'jGetLoadedDynamicLibrariesInfos:{"fetch_all_solibs":true}')
 		for (addr, path) in re.findall(r'"load_address":(\d+).*?"pathname":"([^"]+)"', reply):
 			addr = int(addr, 10)
 			module2addr[path] = addr
 		return module2addr
 
+	# walk the address space a region at a time, see:
+	# https://github.com/llvm-mirror/lldb/blob/master/docs/lldb-gdb-remote.txt
+	def mem_regions(self):
+		regions = []
+		addr = 0
+		while addr < 2**64:
+			reply = rsp.tx_rx(self.conn, 'qMemoryRegionInfo:%x' % addr)
+			if reply == '':
+				raise DebugAdapter.GeneralError('stub doesn\'t support qMemoryRegionInfo')
+			if reply.startswith('E'):
+				break
+			info = dict([kv.split(':', 1) for kv in reply.split(';') if ':' in kv])
+			(start, size) = (int(info['start'], 16), int(info['size'], 16))
+			if not size:
+				break
+			# unmapped gaps have no permissions
+			if info.get('permissions'):
+				regions.append((start, start+size, info['permissions']))
+			addr = start + size
+		return regions
+
 	# break
 	#def break_into(self):
 	#def break_reason(self):
@@ -188,12 +222,11 @@ class DebugAdapterLLDB(gdblike.DebugAdapterGdbLike):
 	# execution control, all return:
 	# returns (STOP_REASON.XXX, <extra_info>)
 	def go(self):
-		self.reg_cache = {}
-		return self.go_generic('c', self.handler_async_pkt)
-
-	def step_into(self):
-		self.reg_cache = {}
-		return self.go_generic('vCont;s', self.handler_async_pkt)
+		while 1:
+			self.reg_cache = {}
+			(reason, data) = self.go_generic('c', self.handler_async_pkt)
+			if not self.condition_false_at_stop(reason):
+				return (reason, data)
 
 	def step_over(self):
 		# gdb, lldb just doesn't have this, you must synthesize it yourself
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+# cache of target memory for DebugMemoryView, kept free of binaryninja so it can
+# be tested on its own
+#
+# memory is cached in page sized bytearrays keyed by page number, least recently
+# used pages are dropped beyond a cap
+#
+# the pages a read is missing are fetched with as few adapter reads as
+# possible, one per run of contiguous pages
+
+import bisect
+import itertools
+from collections import OrderedDict
+
+from . import DebugAdapter
+
+PAGE_SIZE = 0x1000
+# 16MB
+PAGES_MAX = 4096
+
+class PageCache:
+	def __init__(self, pages_max=PAGES_MAX):
+		self.pages_max = pages_max
+		# page number -> bytearray, least recently used first
+		self.pages = OrderedDict()
+		# page numbers that failed to read
+		self.error_pages = set()
+		# sorted mapped (start, end, permissions), None when unknown, see
+		# set_regions()
+		self.regions = None
+		self.region_starts = []
+
+	# read through the cache, None if any of the range can't be read
+	def read(self, adapter, addr, length):
+		first = addr // PAGE_SIZE
+		last = (addr + length - 1) // PAGE_SIZE
+
+		# held here too, a read larger than the cap evicts its own pages
+		pages = {}
+		missing = []
+		for pnum in range(first, last+1):
+			if pnum in self.error_pages:
+				return None
+			if pnum in self.pages:
+				self.pages.move_to_end(pnum)
+				pages[pnum] = self.pages[pnum]
+			elif not self.is_mapped(pnum * PAGE_SIZE, PAGE_SIZE):
+				# fail without asking the target
+				return None
+			else:
+				missing.append(pnum)
+
+		# group consecutive page numbers (constant pnum - index)
+		for (_, run) in itertools.groupby(enumerate(missing), lambda x: x[1] - x[0]):
+			run = [pnum for (_, pnum) in run]
+			if not self.fill(adapter, run[0], len(run), pages):
+				return None
+
+		# assemble the result by slicing pages
+		result = []
+		for pnum in range(first, last+1):
+			base = pnum * PAGE_SIZE
+			start = max(addr, base) - base
+			end = min(addr + length, base + PAGE_SIZE) - base
+			result.append(memoryview(pages[pnum])[start:end])
+		return b''.join(result)
+
+	# read count pages starting at page first into the cache (and pages), if the
+	# range can't be read whole, page at a time finds where it stops
+	def fill(self, adapter, first, count, pages):
+		try:
+			data = adapter.mem_read(first * PAGE_SIZE, count * PAGE_SIZE)
+			if len(data) != count * PAGE_SIZE:
+				raise DebugAdapter.GeneralError('short read')
+		except DebugAdapter.GeneralError:
+			if count == 1:
+				# unmapped, or probably disconnected
+				self.error_pages.add(first)
+				return False
+			for pnum in range(first, first+count):
+				if not self.fill(adapter, pnum, 1, pages):
+					return False
+			return True
+
+		for i in range(count):
+			pages[first+i] = self.page_store(first+i, data[i*PAGE_SIZE:(i+1)*PAGE_SIZE])
+		return True
+
+	def page_store(self, pnum, data):
+		page = bytearray(data)
+		self.pages[pnum] = page
+		self.pages.move_to_end(pnum)
+		while len(self.pages) > self.pages_max:
+			self.pages.popitem(last=False)
+		return page
+
+	# write to the target and the cache, returns the number of bytes written
+	def write_through(self, adapter, addr, data):
+		try:
+			if adapter.mem_write(addr, data) == 0:
+				self.write(addr, data)
+				return len(data)
+		except DebugAdapter.GeneralError:
+			# probably disconnected
+			pass
+
+		# a failed write may have partly happened
+		self.drop(addr, len(data))
+		return 0
+
+	# update cached pages, called after data was written to the target at addr
+	def write(self, addr, data):
+		for pnum in range(addr // PAGE_SIZE, (addr + len(data) + PAGE_SIZE - 1) // PAGE_SIZE):
+			self.error_pages.discard(pnum)
+			page = self.pages.get(pnum)
+			if page == None:
+				continue
+			base = pnum * PAGE_SIZE
+			start = max(addr, base)
+			end = min(addr + len(data), base + PAGE_SIZE)
+			page[start-base:end-base] = data[start-addr:end-addr]
+
+	# drop the pages of a range, eg: one a write may have partly changed
+	def drop(self, addr, length):
+		(first, end) = (addr // PAGE_SIZE, (addr + length + PAGE_SIZE - 1) // PAGE_SIZE)
+		for pnum in [p for p in self.pages if first <= p < end]:
+			del self.pages[pnum]
+		self.error_pages = set([p for p in self.error_pages if not first <= p < end])
+
+	# learn the target's memory map: pages of non-writable mappings survive
+	# invalidate(), reads outside the map fail without asking the target
+	def set_regions(self, regions):
+		self.regions = regions
+		self.region_starts = [start for (start, end, perms) in regions or []]
+
+	# is all of [addr, addr+length) mapped (always, when the map is unknown)
+	def is_mapped(self, addr, length=1):
+		if self.regions == None:
+			return True
+
+		end = addr + length
+		while addr < end:
+			i = bisect.bisect_right(self.region_starts, addr) - 1
+			if i < 0 or self.regions[i][1] <= addr:
+				return False
+			addr = self.regions[i][1]
+		return True
+
+	# the region holding addr, or None
+	def region(self, addr):
+		i = bisect.bisect_right(self.region_starts, addr) - 1
+		if i < 0 or self.regions[i][1] <= addr:
+			return None
+		return self.regions[i]
+
+	# drop everything
+	def clear(self):
+		self.pages = OrderedDict()
+		self.error_pages = set()
+
+	# drop what the target may have changed since the last stop
+	#
+	# pages inside a mapping without write permission (code, read-only data)
+	# are kept if compare(address, data) confirms the target still holds them,
+	# the mapping may have been remapped or mprotect()ed since we learned it
+	def invalidate(self, compare=None):
+		keep = []
+		for pnum in sorted(self.pages):
+			region = self.region(pnum * PAGE_SIZE)
+			if compare and region and (pnum+1) * PAGE_SIZE <= region[1] and not 'w' in region[2]:
+				keep.append(pnum)
+
+		# one comparison per run of contiguous pages
+		kept = set()
+		for (_, run) in itertools.groupby(enumerate(keep), lambda x: x[1] - x[0]):
+			run = [pnum for (_, pnum) in run]
+			try:
+				if compare(run[0] * PAGE_SIZE, b''.join([self.pages[pnum] for pnum in run])):
+					kept.update(run)
+			except (NotImplementedError, DebugAdapter.GeneralError):
+				# can't tell, keep nothing
+				kept = set()
+				break
+
+		for pnum in [p for p in self.pages if not p in kept]:
+			del self.pages[pnum]
+		self.error_pages = set()
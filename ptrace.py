@@ -0,0 +1,698 @@
+#!/usr/bin/env python3
+
+import os
+import signal
+import platform
+import subprocess
+from struct import pack, unpack
+from ctypes import *
+
+from . import gdb
+from . import gdblike
+from . import agentexpr
+from . import DebugAdapter
+
+# sys/ptrace.h
+PTRACE_TRACEME = 0
+PTRACE_PEEKDATA = 2
+PTRACE_PEEKUSER = 3
+PTRACE_POKEDATA = 5
+PTRACE_POKEUSER = 6
+PTRACE_CONT = 7
+PTRACE_SINGLESTEP = 9
+PTRACE_GETREGS = 12
+PTRACE_SETREGS = 13
+PTRACE_DETACH = 17
+PTRACE_SETOPTIONS = 0x4200
+PTRACE_GETEVENTMSG = 0x4201
+
+PTRACE_O_TRACECLONE = 0x8
+PTRACE_O_EXITKILL = 0x100000
+
+PTRACE_EVENT_CLONE = 3
+
+# asm/unistd_64.h
+SYS_tgkill = 234
+
+# sys/wait.h __WALL: wait on clone()'d children (threads) too
+WALL = 0x40000000
+
+# signals that stop the inferior on the debugger's behalf and are not passed on
+# to it when resumed (so a genuine SIGINT sent to the inferior is lost, as with
+# gdb's default "handle SIGINT nopass")
+SIGNALS_NOPASS = [signal.SIGTRAP, signal.SIGSTOP, signal.SIGINT]
+
+# sys/user.h, x86_64
+class user_regs_struct(Structure):
+	_fields_ = [(name, c_ulonglong) for name in ['r15', 'r14', 'r13', 'r12', 'rbp',
+		'rbx', 'r11', 'r10', 'r9', 'r8', 'rax', 'rcx', 'rdx', 'rsi', 'rdi',
+		'orig_rax', 'rip', 'cs', 'eflags', 'rsp', 'ss', 'fs_base', 'gs_base',
+		'ds', 'es', 'fs', 'gs']]
+
+# sys/user.h offsetof(struct user, u_debugreg), x86_64
+DEBUGREG_OFFSET = 848
+
+# dr7 fields per debug register, x86 can't watch reads only so 'read' also
+# stops on writes (as with gdbserver)
+dr7_rw = {'execute': 0b00, 'write': 0b01, 'read': 0b11, 'access': 0b11}
+dr7_len = {1: 0b00, 2: 0b01, 4: 0b11, 8: 0b10}
+
+watch_kind_to_reason = {
+	'execute': DebugAdapter.STOP_REASON.SIGNAL_TRAP,
+	'write': DebugAdapter.STOP_REASON.WATCHPOINT_WRITE,
+	'read': DebugAdapter.STOP_REASON.WATCHPOINT_READ,
+	'access': DebugAdapter.STOP_REASON.WATCHPOINT_ACCESS
+}
+
+# registers in the order gdbserver's amd64 target description lists them
+reg_names = ['rax', 'rbx', 'rcx', 'rdx', 'rsi', 'rdi', 'rbp', 'rsp', 'r8', 'r9',
+	'r10', 'r11', 'r12', 'r13', 'r14', 'r15', 'rip', 'eflags', 'cs', 'ss', 'ds',
+	'es', 'fs', 'gs', 'fs_base', 'gs_base', 'orig_rax']
+
+libc = CDLL(None, use_errno=True)
+libc.ptrace.restype = c_long
+libc.ptrace.argtypes = [c_long, c_long, c_void_p, c_void_p]
+
+def ptrace(request, tid, addr=0, data=0):
+	set_errno(0)
+	rc = libc.ptrace(request, tid, addr, data)
+	# PEEKDATA of a word 0xFFFFFFFFFFFFFFFF legitimately returns -1
+	if rc == -1 and get_errno():
+		raise DebugAdapter.GeneralError('ptrace(%d) on tid %d: %s' % (request, tid, os.strerror(get_errno())))
+	return rc
+
+def preexec():
+	gdblike.preexec()
+	libc.ptrace(PTRACE_TRACEME, 0, None, None)
+
+# talks to the kernel directly instead of through gdbserver, saving two context
+# switches and the hex encoding on every step, register read, and memory access
+#
+# all-stop: every thread is stopped whenever we are called
+class DebugAdapterPtrace(DebugAdapter.DebugAdapter):
+	def __init__(self, **kwargs):
+		DebugAdapter.DebugAdapter.__init__(self, **kwargs)
+		self.os_sig_to_reason = gdb.linux_signal_to_debugadapter_reason
+
+		if platform.machine() != 'x86_64':
+			raise DebugAdapter.GeneralError('ptrace adapter is x86_64 only so far')
+
+		self.proc = None
+		self.pid = None
+		self.mem_fd = None
+		# selected thread, and its registers (fetched on demand)
+		self.tid = None
+		self.regs = None
+		# tid -> signal to deliver when the thread is next resumed
+		self.threads = {}
+		# clone()'d threads whose initial SIGSTOP we haven't seen yet
+		self.threads_starting = set()
+		# threads we sent a SIGSTOP that hasn't been reported yet
+		self.threads_stopping = set()
+		# threads that hit a breakpoint and were rewound onto it
+		self.threads_on_bp = set()
+		# address -> original byte
+		self.breakpoints = {}
+		# debug register -> (address, size, kind) or None
+		self.watchpoints = [None]*4
+		# whether the user set a breakpoint at the library breakpoint too (it
+		# is in breakpoints either way)
+		self.library_breakpoint_user = False
+
+	#--------------------------------------------------------------------------
+	# API
+	#--------------------------------------------------------------------------
+
+	# session start/stop
+	def exec(self, path, args):
+		try:
+			self.proc = subprocess.Popen([path] + list(args), stdin=None, stdout=None, stderr=None, preexec_fn=preexec)
+		except Exception:
+			raise Exception('invoking %s' % path)
+
+		# PTRACE_TRACEME: stopped with SIGTRAP once execve() succeeded
+		self.pid = self.proc.pid
+		(tid, status) = os.waitpid(self.pid, WALL)
+		if not os.WIFSTOPPED(status):
+			raise DebugAdapter.GeneralError('%s did not stop after exec' % path)
+		ptrace(PTRACE_SETOPTIONS, self.pid, 0, PTRACE_O_TRACECLONE | PTRACE_O_EXITKILL)
+
+		self.threads = {self.pid: 0}
+		self.tid = self.pid
+
+		# /proc/<pid>/mem access is bulk and can write read-only mappings, but
+		# might not be mounted, then we PEEK/POKE a word at a time
+		try:
+			self.mem_fd = os.open('/proc/%d/mem' % self.pid, os.O_RDWR)
+		except OSError:
+			self.mem_fd = None
+
+		# library loads and unloads stop (and resume) at the dynamic linker,
+		# see modules_changed()
+		try:
+			self.library_breakpoint_set(gdb.dl_debug_state_from_proc(self.pid))
+		except Exception:
+			# unreadable /proc or ELF, library changes go unnoticed
+			pass
+
+	def detach(self):
+		self.library_breakpoint = None
+		for addr in list(self.breakpoints):
+			self.breakpoint_clear(addr)
+
+		# armed debug registers would kill the process with SIGTRAP
+		if self.watchpoint_list():
+			self.watchpoints = [None]*4
+			self.debugreg_apply()
+
+		for (tid, sig) in self.threads.items():
+			try:
+				ptrace(PTRACE_DETACH, tid, 0, sig)
+			except DebugAdapter.GeneralError:
+				pass
+
+		# undo SIGSTOPs sent to stop all threads that are still pending
+		if self.threads_stopping:
+			os.kill(self.pid, signal.SIGCONT)
+
+		self.session_end()
+
+	def quit(self):
+		if self.threads:
+			os.kill(self.pid, signal.SIGKILL)
+
+			# a traced thread group leader is reported last, after its threads
+			for tid in sorted(self.threads, key=lambda t: t == self.pid):
+				try:
+					while 1:
+						(_, status) = os.waitpid(tid, WALL)
+						if os.WIFEXITED(status) or os.WIFSIGNALED(status):
+							break
+				except ChildProcessError:
+					pass
+
+			self.proc.returncode = -signal.SIGKILL
+
+		self.session_end()
+
+	# threads
+	def thread_list(self):
+		return sorted(self.threads)
+
+	def thread_selected(self):
+		if self.tid == None:
+			raise DebugAdapter.GeneralError('no tid set by last stop or thread switch')
+		return self.tid
+
+	def thread_select(self, tid):
+		if not tid in self.threads:
+			raise DebugAdapter.GeneralError("tid 0x%X is not alive" % tid)
+		self.tid = tid
+		self.regs = None
+
+	# breakpoints
+	# condition (see agentexpr) is evaluated by go() at each hit
+	def breakpoint_set(self, addr, condition=None):
+		code = None
+		if condition:
+			code = agentexpr.compile_expr(condition, {name: i for (i, name) in enumerate(reg_names)})
+
+		if addr == self.library_breakpoint and not self.library_breakpoint_user:
+			self.library_breakpoint_user = True
+		else:
+			if addr in self.breakpoints:
+				raise DebugAdapter.BreakpointSetError("breakpoint set at 0x%X already exists" % addr)
+
+			try:
+				data = self.mem_read_raw(addr, 1)
+				self.mem_write_raw(addr, b'\xCC')
+			except DebugAdapter.GeneralError:
+				raise DebugAdapter.BreakpointSetError('writing breakpoint at 0x%X' % addr)
+
+			self.breakpoints[addr] = data
+
+		if code:
+			self.breakpoint_conditions[addr] = code
+		return 0
+
+	def breakpoint_clear(self, addr):
+		if addr == self.library_breakpoint:
+			if not self.library_breakpoint_user:
+				raise DebugAdapter.BreakpointClearError("breakpoint clear at 0x%X doesn't exist" % addr)
+			# the library breakpoint stays
+			self.library_breakpoint_user = False
+			self.breakpoint_conditions.pop(addr, None)
+			return 0
+		if not addr in self.breakpoints:
+			raise DebugAdapter.BreakpointClearError("breakpoint clear at 0x%X doesn't exist" % addr)
+
+		try:
+			self.mem_write_raw(addr, self.breakpoints[addr])
+		except DebugAdapter.GeneralError:
+			raise DebugAdapter.BreakpointClearError('restoring original byte at 0x%X' % addr)
+
+		del self.breakpoints[addr]
+		self.breakpoint_conditions.pop(addr, None)
+		return 0
+
+	def breakpoint_list(self):
+		return [a for a in self.breakpoints if a != self.library_breakpoint or self.library_breakpoint_user]
+
+	# hardware breakpoints and watchpoints
+	def watchpoint_set(self, address, size, kind):
+		if not kind in dr7_rw:
+			raise DebugAdapter.GeneralError('unknown watchpoint kind: %s' % kind)
+		if not size in dr7_len or address % size or (kind == 'execute' and size != 1):
+			raise DebugAdapter.BreakpointSetError('debug registers watch 1, 2, 4, or 8 aligned bytes (execute: 1)')
+		if (address, size, kind) in self.watchpoints:
+			raise DebugAdapter.BreakpointSetError('%s watchpoint at 0x%X already exists' % (kind, address))
+		if not None in self.watchpoints:
+			raise DebugAdapter.BreakpointSetError('all debug registers in use')
+
+		slot = self.watchpoints.index(None)
+		self.watchpoints[slot] = (address, size, kind)
+		try:
+			self.debugreg_apply()
+		except DebugAdapter.GeneralError:
+			self.watchpoints[slot] = None
+			self.debugreg_apply()
+			raise DebugAdapter.BreakpointSetError('writing debug registers')
+		return 0
+
+	def watchpoint_clear(self, address, size, kind):
+		if not (address, size, kind) in self.watchpoints:
+			raise DebugAdapter.BreakpointClearError("%s watchpoint at 0x%X doesn't exist" % (kind, address))
+
+		self.watchpoints[self.watchpoints.index((address, size, kind))] = None
+		try:
+			self.debugreg_apply()
+		except DebugAdapter.GeneralError:
+			raise DebugAdapter.BreakpointClearError('writing debug registers')
+		return 0
+
+	def watchpoint_list(self):
+		return [w for w in self.watchpoints if w]
+
+	# registers
+	def reg_read(self, name):
+		if not name in reg_names:
+			raise DebugAdapter.GeneralError("requested register %s doesnt exist" % name)
+		return getattr(self.regs_get(), name)
+
+	def reg_write(self, name, value):
+		if not name in reg_names:
+			raise DebugAdapter.GeneralError("requested register %s doesnt exist" % name)
+		regs = self.regs_get()
+		setattr(regs, name, value & 0xFFFFFFFFFFFFFFFF)
+		ptrace(PTRACE_SETREGS, self.tid, 0, addressof(regs))
+
+	def reg_list(self):
+		return list(reg_names)
+
+	def reg_bits(self, name):
+		if not name in reg_names:
+			raise DebugAdapter.GeneralError("requested register %s doesnt exist" % name)
+		return 64
+
+	# mem
+	def mem_read(self, address, length):
+		data = bytearray(self.mem_read_raw(address, length))
+
+		# hide our breakpoints
+		for (addr, orig) in self.breakpoints.items():
+			if address <= addr < address+length:
+				data[addr-address] = orig[0]
+
+		return bytes(data)
+
+	def mem_write(self, address, data):
+		data = bytearray(data)
+
+		# writes over our breakpoints change what they restore
+		for addr in self.breakpoints:
+			if address <= addr < address+len(data):
+				self.breakpoints[addr] = bytes(data[addr-address:addr-address+1])
+				data[addr-address] = 0xCC
+
+		self.mem_write_raw(address, data)
+		return 0
+
+	def mem_modules(self):
+		return gdb.mem_modules_from_maps(self.pid)
+
+	def mem_regions(self):
+		return gdb.mem_regions_from_maps(self.pid)
+
+	# break
+	def break_into(self):
+		os.kill(self.pid, signal.SIGINT)
+		return True
+
+	# execution control, all return:
+	# returns (STOP_REASON.XXX, <extra_info>)
+	def go(self):
+		while 1:
+			if not self.threads:
+				return (DebugAdapter.STOP_REASON.PROCESS_EXITED, None)
+
+			# threads sitting on breakpoints execute the original instruction first
+			self.regs = None
+			for tid in sorted(self.threads_on_bp | set([self.tid])):
+				self.thread_select(tid)
+				if self.reg_read('rip') in self.breakpoints:
+					(tid, status) = self.step_thread(tid)
+					if not os.WIFSTOPPED(status) or os.WSTOPSIG(status) != signal.SIGTRAP:
+						return self.stop_report(tid, status, True)
+					# the original instruction hit a watchpoint
+					watch = self.watchpoint_hit(tid)
+					if watch:
+						(address, size, kind) = watch
+						return (watch_kind_to_reason[kind], address)
+			self.threads_on_bp = set()
+
+			# new threads are resumed once their initial stop is seen
+			for tid in list(self.threads):
+				if not tid in self.threads_starting:
+					self.resume(tid, PTRACE_CONT)
+
+			(reason, data) = self.stop_report(*self.wait_event())
+			if not self.library_event_at_stop(reason) and not self.condition_false_at_stop(reason):
+				return (reason, data)
+
+	def step_into(self):
+		if not self.threads:
+			return (DebugAdapter.STOP_REASON.PROCESS_EXITED, None)
+
+		# stepping off a breakpoint, only the selected thread runs (the others
+		# would run past breakpoints of their own while it's lifted)
+		self.regs = None
+		if self.reg_read('rip') in self.breakpoints:
+			self.threads_on_bp.discard(self.tid)
+			(tid, status) = self.step_thread(self.tid)
+			return self.stop_report(tid, status, True)
+
+		# otherwise the others run meanwhile, as with vCont;s:<tid>;c, so a
+		# thread waiting on another (a join, a lock) completes its step, those
+		# sitting on breakpoints stay stopped
+		for tid in list(self.threads):
+			if tid != self.tid and not tid in self.threads_starting and not tid in self.threads_on_bp:
+				self.resume(tid, PTRACE_CONT)
+		(tid, status) = self.step_thread(self.tid)
+		return self.stop_report(tid, status, True, False)
+
+	def step_over(self):
+		# ptrace doesn't have this, you must synthesize it yourself
+		raise NotImplementedError('step over')
+
+	#--------------------------------------------------------------------------
+	# helpers, NOT part of the API
+	#--------------------------------------------------------------------------
+
+	def session_end(self):
+		if self.mem_fd != None:
+			os.close(self.mem_fd)
+			self.mem_fd = None
+		self.library_breakpoint = None
+		self.library_breakpoint_user = False
+		self.threads = {}
+		self.threads_starting = set()
+		self.threads_stopping = set()
+		self.threads_on_bp = set()
+		self.tid = None
+		self.regs = None
+
+	def regs_get(self):
+		if self.tid == None:
+			raise DebugAdapter.GeneralError('no tid set by last stop or thread switch')
+		if self.regs == None:
+			regs = user_regs_struct()
+			ptrace(PTRACE_GETREGS, self.tid, 0, addressof(regs))
+			self.regs = regs
+		return self.regs
+
+	def mem_read_raw(self, address, length):
+		if self.mem_fd == None:
+			return self.mem_peek(address, length)
+
+		try:
+			data = os.pread(self.mem_fd, length, address)
+			if len(data) == length:
+				return data
+		except (OSError, OverflowError):
+			pass
+
+		raise DebugAdapter.GeneralError('reading from address 0x%X' % address)
+
+	def mem_write_raw(self, address, data):
+		if self.mem_fd == None:
+			return self.mem_poke(address, data)
+
+		try:
+			if os.pwrite(self.mem_fd, data, address) == len(data):
+				return
+		except (OSError, OverflowError):
+			pass
+
+		raise DebugAdapter.GeneralError('writing to address 0x%X' % address)
+
+	# the aligned words covering [address, address+length)
+	def mem_peek(self, address, length):
+		start = address & ~7
+		end = (address + length + 7) & ~7
+		try:
+			words = [ptrace(PTRACE_PEEKDATA, self.tid, a) for a in range(start, end, 8)]
+		except (DebugAdapter.GeneralError, ArgumentError):
+			raise DebugAdapter.GeneralError('reading from address 0x%X' % address)
+		data = b''.join([pack('<q', w) for w in words])
+		return data[address-start:address-start+length]
+
+	def mem_poke(self, address, data):
+		start = address & ~7
+		words = bytearray(self.mem_peek(start, ((address + len(data) + 7) & ~7) - start))
+		words[address-start:address-start+len(data)] = data
+		try:
+			for i in range(0, len(words), 8):
+				ptrace(PTRACE_POKEDATA, self.tid, start+i, unpack('<Q', words[i:i+8])[0])
+		except (DebugAdapter.GeneralError, ArgumentError):
+			raise DebugAdapter.GeneralError('writing to address 0x%X' % address)
+
+	# PTRACE_CONT or PTRACE_SINGLESTEP a thread, passing on its pending signal
+	def resume(self, tid, request):
+		try:
+			# dr6 status bits are sticky, a stale one would be taken for a hit
+			if self.watchpoint_list():
+				ptrace(PTRACE_POKEUSER, tid, DEBUGREG_OFFSET + 8*6, 0)
+			ptrace(request, tid, 0, self.threads[tid])
+			self.threads[tid] = 0
+		except DebugAdapter.GeneralError:
+			# died while stopped, its exit is reported by waitpid()
+			pass
+
+	def library_breakpoint_insert(self, addr):
+		self.breakpoint_set(addr)
+
+	def reg_name_from_id(self, rid):
+		return reg_names[rid]
+
+	# single step one thread (with the original instruction under a breakpoint)
+	# returns (tid, status)
+	def step_thread(self, tid):
+		self.thread_select(tid)
+		addr = self.reg_read('rip')
+		orig = self.breakpoints.get(addr)
+		self.regs = None
+
+		if orig:
+			self.mem_write_raw(addr, orig)
+		try:
+			self.resume(tid, PTRACE_SINGLESTEP)
+			while 1:
+				(tid, status) = os.waitpid(tid, WALL)
+				if not self.thread_event(tid, status):
+					return (tid, status)
+				# a clone() was stepped over, it stopped us at the syscall's exit
+				if status >> 16 == PTRACE_EVENT_CLONE:
+					return (tid, (signal.SIGTRAP << 8) | 0x7F)
+				# stepped into its own exit
+				if not tid in self.threads:
+					return (tid, status)
+				self.resume(tid, PTRACE_SINGLESTEP)
+		finally:
+			# (unless the whole process exited)
+			if orig and tid in self.threads:
+				try:
+					self.mem_write_raw(addr, b'\xCC')
+				except DebugAdapter.GeneralError:
+					pass
+
+	# bookkeeping for a waitpid() status that is not to be reported
+	# returns whether it was consumed
+	def thread_event(self, tid, status):
+		if os.WIFEXITED(status) or os.WIFSIGNALED(status):
+			# the thread group leader exits last, that is the process exiting
+			if tid == self.pid:
+				return False
+			self.threads.pop(tid, None)
+			self.threads_stopping.discard(tid)
+			self.threads_on_bp.discard(tid)
+			return True
+
+		if not os.WIFSTOPPED(status):
+			return True
+
+		if status >> 16 == PTRACE_EVENT_CLONE:
+			tid_new = c_ulong()
+			ptrace(PTRACE_GETEVENTMSG, tid, 0, addressof(tid_new))
+			# new thread's SIGSTOP might have been reported already
+			if not tid_new.value in self.threads:
+				self.threads[tid_new.value] = 0
+				self.threads_starting.add(tid_new.value)
+			return True
+
+		sig = os.WSTOPSIG(status)
+		if sig == signal.SIGSTOP and (tid in self.threads_starting or not tid in self.threads):
+			self.threads[tid] = 0
+			self.threads_starting.discard(tid)
+			# debug registers aren't inherited
+			if self.watchpoint_list():
+				self.debugreg_apply([tid])
+			return True
+		if sig == signal.SIGSTOP and tid in self.threads_stopping:
+			self.threads_stopping.discard(tid)
+			return True
+
+		return False
+
+	# wait for an event worth reporting, threads coming and going are handled
+	# and resumed along the way
+	# returns (tid, status)
+	def wait_event(self):
+		while 1:
+			(tid, status) = os.waitpid(-1, WALL)
+			if not self.thread_event(tid, status):
+				return (tid, status)
+			if tid in self.threads:
+				self.resume(tid, PTRACE_CONT)
+
+	# stop every other thread, so the process is stopped as a whole
+	def stop_others(self, tid_stopped):
+		for tid in list(self.threads):
+			if tid == tid_stopped:
+				continue
+
+			# at most one SIGSTOP of ours pending per thread, a second one sent
+			# after the first was dequeued would be reported separately
+			if not tid in self.threads_starting and not tid in self.threads_stopping:
+				libc.syscall(SYS_tgkill, self.pid, tid, signal.SIGSTOP)
+				self.threads_stopping.add(tid)
+
+			while tid in self.threads_stopping or tid in self.threads_starting:
+				try:
+					(_, status) = os.waitpid(tid, WALL)
+				except ChildProcessError:
+					self.threads.pop(tid, None)
+					break
+				if self.thread_event(tid, status):
+					# stopped at a clone() event instead
+					if os.WIFSTOPPED(status) and status >> 16 == PTRACE_EVENT_CLONE:
+						break
+					continue
+
+				# stopped for its own reason first, it sees our SIGSTOP when
+				# resumed (and thread_event() then swallows it)
+				sig = os.WSTOPSIG(status)
+				if sig == signal.SIGTRAP:
+					# hits again when resumed (a watchpoint hit is lost)
+					if self.watchpoint_hit(tid) == None:
+						self.breakpoint_rewind(tid)
+					self.threads_on_bp.discard(tid)
+				elif not sig in SIGNALS_NOPASS:
+					self.threads[tid] = sig
+				break
+
+	# program the debug registers of the given (default: all stopped) threads
+	def debugreg_apply(self, tids=None):
+		if tids == None:
+			tids = [t for t in self.threads if not t in self.threads_starting]
+
+		dr7 = 0
+		for (slot, watch) in enumerate(self.watchpoints):
+			if watch == None:
+				continue
+			(address, size, kind) = watch
+			dr7 |= (1 << (2*slot)) | (dr7_rw[kind] << (16+4*slot)) | (dr7_len[size] << (18+4*slot))
+
+		for tid in tids:
+			# disable before changing addresses, the kernel validates each write
+			ptrace(PTRACE_POKEUSER, tid, DEBUGREG_OFFSET + 8*7, 0)
+			for (slot, watch) in enumerate(self.watchpoints):
+				if watch != None:
+					ptrace(PTRACE_POKEUSER, tid, DEBUGREG_OFFSET + 8*slot, watch[0])
+			ptrace(PTRACE_POKEUSER, tid, DEBUGREG_OFFSET + 8*7, dr7)
+
+	# the watchpoint (if any) that made a thread trap, from dr6
+	def watchpoint_hit(self, tid):
+		if not self.watchpoint_list():
+			return None
+
+		dr6 = ptrace(PTRACE_PEEKUSER, tid, DEBUGREG_OFFSET + 8*6)
+		# status bits are sticky
+		ptrace(PTRACE_POKEUSER, tid, DEBUGREG_OFFSET + 8*6, 0)
+		for (slot, watch) in enumerate(self.watchpoints):
+			if watch and dr6 & (1 << slot):
+				return watch
+		return None
+
+	# a thread that executed one of our int3's is moved back onto it
+	# returns whether it did
+	def breakpoint_rewind(self, tid):
+		self.thread_select(tid)
+		addr = self.reg_read('rip') - 1
+		if not addr in self.breakpoints:
+			return False
+		self.reg_write('rip', addr)
+		self.threads_on_bp.add(tid)
+		return True
+
+	# stepped: tid was single stepped, alone: no other thread ran (by default
+	# when stepped)
+	# returns (STOP_REASON.XXX, <extra_info>)
+	def stop_report(self, tid, status, stepped=False, alone=None):
+		self.regs = None
+		if alone == None:
+			alone = stepped
+
+		# a stepped thread exited, the others remain
+		if tid != self.pid and not tid in self.threads:
+			if not alone:
+				self.stop_others(tid)
+			self.thread_select(self.pid if self.pid in self.threads else self.thread_list()[0])
+			return (DebugAdapter.STOP_REASON.UNKNOWN, None)
+
+		if os.WIFEXITED(status) or os.WIFSIGNALED(status):
+			if os.WIFEXITED(status):
+				exit_status = os.WEXITSTATUS(status)
+			else:
+				exit_status = -os.WTERMSIG(status)
+			print('inferior exited with status: %d' % exit_status)
+			self.proc.returncode = exit_status
+			self.session_end()
+			return (DebugAdapter.STOP_REASON.PROCESS_EXITED, exit_status)
+
+		if not alone:
+			self.stop_others(tid)
+		self.thread_select(tid)
+
+		sig = os.WSTOPSIG(status)
+		if sig == signal.SIGTRAP:
+			watch = self.watchpoint_hit(tid)
+			# after a step, rip-1 might be a breakpoint on a one byte instruction
+			if not stepped:
+				self.breakpoint_rewind(tid)
+			if watch:
+				(address, size, kind) = watch
+				return (watch_kind_to_reason[kind], address)
+		elif not sig in SIGNALS_NOPASS:
+			self.threads[tid] = sig
+
+		return (self.os_sig_to_reason.get(sig, DebugAdapter.STOP_REASON.UNKNOWN), sig)
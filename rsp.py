@@ -1,5 +1,7 @@
+import os
 import re
 import socket
+import zlib
 
 # custom exceptions
 class RspDisconnected(Exception):
@@ -11,46 +13,124 @@ class RspExpectedStartOfPacket(Exception):
 class RspGeneralError(Exception):
 	pass
 
-def send_raw(sock, data):
-	sock.send(data.encode('utf-8'))
+# most bytes requested from the socket at once
+RECV_SIZE = 0x10000
 
-def send_packet_data(sock, data):
+# a connection to a stub, buffering whatever the socket hands us so packets
+# are framed from large reads instead of one recv() per byte
+#
+# the socket may be TCP or a unix domain socket, other transports override
+# read(), send(), and close()
+class RspConnection:
+	def __init__(self, sock):
+		self.sock = sock
+		self.buf = bytearray()
+		# cleared once the stub agrees to QStartNoAckMode
+		self.acks = True
+		# replies owed for packets tx_rx_many() sent ahead, see drain()
+		self.pending = 0
+		# set when a packet or reply broke off half way, requests then fail
+		# rather than be paired with the wrong replies
+		self.desynced = False
+
+	# block until at least one more byte is buffered
+	def fill(self):
+		tmp = self.read()
+		if tmp == b'':
+			raise RspDisconnected('disconnection while receiving')
+		self.buf += tmp
+
+	# transport: up to RECV_SIZE bytes, b'' when disconnected
+	def read(self):
+		return self.sock.recv(RECV_SIZE)
+
+	def peek(self):
+		if not self.buf:
+			self.fill()
+		return self.buf[0:1]
+
+	def recv(self, n=1):
+		while not self.buf:
+			self.fill()
+		result = bytes(self.buf[0:n])
+		del self.buf[0:n]
+		return result
+
+	def send(self, data):
+		self.sock.sendall(data)
+
+	def close(self):
+		self.sock.shutdown(socket.SHUT_RDWR)
+		self.sock.close()
+
+# a connection over a stub's stdout and stdin, eg: 'gdbserver - <prog>'
+class RspPipeConnection(RspConnection):
+	def __init__(self, pipe_in, pipe_out):
+		RspConnection.__init__(self, None)
+		self.pipe_in = pipe_in
+		self.pipe_out = pipe_out
+
+	def read(self):
+		return os.read(self.pipe_in.fileno(), RECV_SIZE)
+
+	def send(self, data):
+		data = memoryview(data)
+		while data:
+			try:
+				data = data[os.write(self.pipe_out.fileno(), data):]
+			except BrokenPipeError:
+				raise RspDisconnected('disconnection while sending')
+
+	def close(self):
+		self.pipe_out.close()
+		self.pipe_in.close()
+
+def send_raw(conn, data):
+	conn.send(data.encode('utf-8'))
+
+def send_packet_data(conn, data):
+	# data may be str, or bytes for packets carrying binary (eg: 'X')
+	if isinstance(data, str):
+		data = data.encode('utf-8')
 	# packet is exactly "$<data>#<checksum>"
-	checksum = sum(map(ord, data))
-	packet = '$' + data + '#' + ("%02x" % (checksum % 256))
-	send_raw(sock, packet)
-
-def recv_packet_data(sock):
-	hexes = b'abcdefABCDEF0123456789'
+	checksum = sum(data)
+	packet = b'$' + data + b'#' + (b'%02x' % (checksum % 256))
+	conn.send(packet)
 
+# decode=False returns the payload as bytes, for replies carrying binary
+def recv_packet_data(conn, decode=True):
 	# consume ack's
-	tmp = b'+'
-	while tmp == b'+':
-		tmp = sock.recv(1)
-		if tmp == b'':
-			raise RspDisconnected('disconnection while receiving packet')
+	while conn.peek() == b'+':
+		conn.recv(1)
 
 	# start packet
-	pkt = tmp
-	if pkt != b'$':
-		raise RspExpectedStartOfPacket('got instead: %s' % str(pkt))
+	if conn.peek() != b'$':
+		raise RspExpectedStartOfPacket('got instead: %s' % str(conn.recv(1)))
+
+	# consume until '#' and checksum bytes, scanning only newly arrived data
+	scanned = 1
+	while 1:
+		end = conn.buf.find(b'#', scanned)
+		if end != -1 and len(conn.buf) >= end+3:
+			break
+		scanned = len(conn.buf) if end == -1 else end
+		conn.fill()
 
-	# consume until '#' and checksum bytes
-	while not (len(pkt)>=3 and pkt[-3] == ord('#') and pkt[-2] in hexes and pkt[-1] in hexes):
-		tmp = sock.recv(1)
-		if tmp == b'':
-			raise RspDisconnected('disconnection while receiving packet')
-		pkt = pkt + tmp
+	pkt = bytes(conn.buf[1:end])
+	del conn.buf[0:end+3]
 
 	# acknowledge
-	send_raw(sock, '+')
+	if conn.acks:
+		send_raw(conn, '+')
 
-	return pkt[1:-3].decode('utf-8')
+	if not decode:
+		return pkt
+	return pkt.decode('utf-8')
 
-def consume_ack(sock):
-	resp = sock.recv(1)
-	if resp == b'':
-		raise RspDisconnected('disconnection while waiting for ack')
+def consume_ack(conn):
+	if not conn.acks:
+		return None
+	resp = conn.recv(1)
 	if resp != b'+':
 		raise RspAckMissing('got instead: %s' % str(resp))
 	return b'+'
@@ -68,48 +148,52 @@ def consume_ack(sock):
 #
 #	print('RSP connection status: %s' % str(result))
 
-def tx_rx(sock, data, expect='ack_then_reply', handler_async_pkt=None):
-	send_packet_data(sock, data)
+def tx_rx(conn, data, expect='ack_then_reply', handler_async_pkt=None, decode=True):
+	drain(conn)
+	send_packet_data(conn, data)
 
 	reply = None
 
 	if expect == 'nothing':
 		reply = ''
 	elif expect == 'ack_then_reply':
-		consume_ack(sock)
-		reply = recv_packet_data(sock)
+		consume_ack(conn)
+		reply = recv_packet_data(conn, decode)
+		# binary replies are left to binary_decode()
+		if not decode:
+			return reply
 	elif expect == 'mixed_output_ack_then_reply':
 		ack_received = False
 		while 1:
-			peek1 = sock.recv(1, socket.MSG_PEEK)
+			peek1 = conn.peek()
 
 			if peek1 == b'+':
 				if ack_received:
 					raise RspGeneralError('received two acks, somethings wrong')
-				sock.recv(1)
+				conn.recv(1)
 				ack_received = True
 				continue
 
 			if peek1 != b'$':
-				raise RspExpectedStartOfPacket('got: %s' % sock.recv(16))
-			reply = recv_packet_data(sock)
+				raise RspExpectedStartOfPacket('got: %s' % conn.recv(16))
+			reply = recv_packet_data(conn)
 			if reply[0] == 'O':
 				if handler_async_pkt:
 					handler_async_pkt(reply)
 			else:
 				# return first non-output packet
 				break
-		if not ack_received:
+		if conn.acks and not ack_received:
 			raise RspGeneralError('expected ack, none received')
 		result = reply
 	elif expect == 'ack_then_ok':
-		consume_ack(sock)
-		reply = recv_packet_data(sock)
+		consume_ack(conn)
+		reply = recv_packet_data(conn)
 		if reply != 'OK':
 			raise RspGeneralError('expected OK, got: %s' % reply)
 	elif expect == 'ack_then_empty':
-		consume_ack(sock)
-		reply = recv_packet_data(sock)
+		consume_ack(conn)
+		reply = recv_packet_data(conn)
 		if reply != '':
 			raise RspGeneralError('expected empty, got: %s' % reply)
 	else:
@@ -120,20 +204,76 @@ def tx_rx(sock, data, expect='ack_then_reply', handler_async_pkt=None):
 
 	return reply
 
-def send_ack(sock):
+# send up to 'window' packets ahead of collecting their replies, yielding the
+# replies in the order the packets were sent
+#
+# a stub in ack mode treats anything but '+' after its reply as a request to
+# retransmit, so there the packets go one at a time
+#
+# replies a consumer stopped early didn't collect are drained when the
+# generator is closed, or at the latest by the next request
+def tx_rx_many(conn, datas, window=8, decode=True):
+	drain(conn)
+	if conn.acks:
+		window = 1
+
+	datas = iter(datas)
+	try:
+		while 1:
+			while conn.pending < window:
+				data = next(datas, None)
+				if data == None:
+					break
+				send_packet_data(conn, data)
+				conn.pending += 1
+
+			if not conn.pending:
+				break
+
+			consume_ack(conn)
+			reply = recv_packet_data(conn, decode)
+			conn.pending -= 1
+
+			if decode and '*' in reply:
+				reply = un_rle(reply)
+
+			yield reply
+	except GeneratorExit:
+		drain(conn)
+		raise
+	except BaseException:
+		conn.desynced = True
+		raise
+
+# receive and drop the replies owed for packets sent ahead, so they aren't
+# taken for those of the next request
+def drain(conn):
+	if conn.desynced:
+		raise RspDisconnected('replies out of sync with requests')
+
+	try:
+		while conn.pending:
+			consume_ack(conn)
+			recv_packet_data(conn, False)
+			conn.pending -= 1
+	except BaseException:
+		conn.desynced = True
+		raise
+
+def send_ack(conn):
 	packet = '+'
-	sock.send(packet)
-	print(packet.decode('utf-8'), '->')
+	send_raw(conn, packet)
+	print(packet, '->')
 
 #--------------------------------------------------------------------------
 # GDB RSP FUNCTIONS (HIGHER LEVEL)
 #--------------------------------------------------------------------------
 
-def register_scan(sock):
+def register_scan(conn):
 	result = [None]*256
 
 	for i in range(256):
-		reply = tx_rx(sock, 'qRegisterInfo%02X' % i, 'ack_then_reply')
+		reply = tx_rx(conn, 'qRegisterInfo%02X' % i, 'ack_then_reply')
 		if not reply.startswith('name:'):
 			break
 
@@ -154,23 +294,121 @@ def register_scan(sock):
 
 	return result
 
+# read a qXfer object (eg: 'features' annex 'target.xml', 'auxv', 'threads',
+# 'libraries-svr4', 'exec-file' annex '<pid>') at successive offsets, yielding
+# each chunk of data as it arrives, until the stub says it's the last
+def qxfer_read(conn, obj, annex='', length=0xfff):
+	offset = 0
+	while 1:
+		packet = 'qXfer:%s:read:%s:%x,%x' % (obj, annex, offset, length)
+		reply = tx_rx(conn, packet, decode=False)
+		if not reply[0:1] in [b'm', b'l']:
+			raise RspGeneralError('%s replied: %s' % (packet, reply))
+
+		data = binary_decode(reply[1:])
+		if data:
+			yield data
+		if reply[0:1] == b'l':
+			break
+		if not data:
+			raise RspGeneralError('%s replied with no data and no end' % packet)
+		offset += len(data)
+
+# expand "X*N" to X repeated ord(N)-29 more times, in a single pass over str
+# or bytes/bytearray
 def un_rle(data):
-	if not '*' in data:
+	star = '*' if isinstance(data, str) else b'*'
+	if not star in data:
 		return data
 
-	skip = 0
-	result = ''
-	for (i,char) in enumerate(data):
-		if skip:
-			skip = False
-		elif char == '*':
-			repeat = ord(data[i+1])-29
-			result = result + result[-1]*repeat
-			skip = True
+	# every piece after the first starts with the count of a run
+	pieces = data.split(star)
+	result = [pieces[0]]
+	last = pieces[0][-1:]
+	literal = False
+	for piece in pieces[1:]:
+		if literal:
+			# the count was '*' itself, this piece is plain data
+			literal = False
+		elif not piece:
+			result.append(last * 13)
+			literal = True
+			continue
 		else:
-			result += char
+			result.append(last * (ord(piece[0:1]) - 29))
+			piece = piece[1:]
+		if piece:
+			result.append(piece)
+			last = piece[-1:]
+
+	return data[0:0].join(result)
+
+# escape data for the binary portion of a packet (eg: 'X'), see:
+# https://sourceware.org/gdb/current/onlinedocs/gdb/Overview.html#Binary-Data
+def binary_encode(data):
+	# '}' first, so the escapes that follow aren't themselves escaped
+	data = data.replace(b'}', b'}\x5d')
+	data = data.replace(b'#', b'}\x03')
+	data = data.replace(b'$', b'}\x04')
+	data = data.replace(b'*', b'}\x0a')
+	return data
+
+# undo run length encoding then escaping of binary data in a reply (eg: 'x')
+def binary_decode(data):
+	data = un_rle(data)
+
+	if not b'}' in data:
+		return data
 
-	return result
+	result = bytearray()
+	i = 0
+	while i < len(data):
+		j = data.find(b'}', i)
+		if j == -1 or j+1 >= len(data):
+			result += data[i:]
+			break
+		result += data[i:j]
+		result.append(data[j+1] ^ 0x20)
+		i = j+2
+
+	return bytes(result)
+
+# bytes with their bits reversed
+BIT_REVERSE = bytes([int('{:08b}'.format(i)[::-1], 2) for i in range(256)])
+
+# the CRC-32 a stub replies to 'qCRC' with: polynomial 0x04C11DB7 shifted in
+# msb first from 0xFFFFFFFF, no final xor
+#
+# that's zlib's (lsb first) CRC-32 of the bit reversed data, bit reversed
+def crc32(data):
+	crc = zlib.crc32(bytes(data).translate(BIT_REVERSE), 0) ^ 0xFFFFFFFF
+	return int('{:032b}'.format(crc)[::-1], 2)
+
+# map a qSupported reply to a feature table, eg:
+# 'PacketSize=3fff;QStartNoAckMode+;qXfer:auxv:read-' ->
+# {'PacketSize':0x3fff, 'QStartNoAckMode':True, 'qXfer:auxv:read':False}
+def packet_qSupported_to_dict(data):
+	features = {}
+
+	for feature in data.split(';'):
+		if not feature:
+			continue
+
+		if '=' in feature:
+			(key, val) = feature.split('=', 1)
+			if key == 'PacketSize':
+				val = int(val, 16)
+			features[key] = val
+		elif feature[-1] == '+':
+			features[feature[:-1]] = True
+		elif feature[-1] == '-':
+			features[feature[:-1]] = False
+		elif feature[-1] == '?':
+			features[feature[:-1]] = None
+		else:
+			raise RspGeneralError('unexpected feature in qSupported reply: %s' % feature)
+
+	return features
 
 def packet_T_to_dict(data, lookup_reg={}):
 	# map the info to a context dictionary
@@ -184,8 +422,8 @@ def packet_T_to_dict(data, lookup_reg={}):
 		if not ':' in key_vals:
 			raise RspGeneralError('expected \':\' in packet T reply: %s' % key_vals)
 
+		# (already run length decoded by tx_rx)
 		(key, val) = key_vals.split(':')
-		val = un_rle(val)
 
 		if key == 'thread':
 			tid = None
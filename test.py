@@ -3,21 +3,30 @@
 # unit tests for debugger
 
 import os
+import re
 import sys
 import time
+import socket
+import hashlib
+import tempfile
 import platform
 import threading
 
 from struct import unpack
 
 sys.path.append('..')
+import debugger.rsp as rsp
 import debugger.lldb as lldb
+import debugger.gdblike as gdblike
 import debugger.dbgeng as dbgeng
 import debugger.DebugAdapter as DebugAdapter
+import debugger.memcache as memcache
+import debugger.agentexpr as agentexpr
 import debugger.utils as utils
 
 # globals
 adapter = None
+adapter_kwargs = {}
 
 #--------------------------------------------------------------------------
 # UTILITIES
@@ -136,6 +145,42 @@ def assert_general_error(func):
 		raised = True
 	assert raised
 
+# a stub on the other end of a socket pair, replying handler(packet) to each
+# packet, without acks (as after QStartNoAckMode)
+class FakeStub:
+	def __init__(self, handler):
+		(self.sock, sock) = socket.socketpair()
+		self.handler = handler
+		self.packets = []
+		threading.Thread(target=self.serve, args=(sock,), daemon=True).start()
+
+	def serve(self, sock):
+		buf = b''
+		while 1:
+			data = sock.recv(4096)
+			if not data:
+				return
+			buf += data
+			while b'#' in buf and len(buf) >= buf.index(b'#')+3:
+				end = buf.index(b'#')
+				packet = buf[buf.index(b'$')+1:end].decode('latin-1')
+				buf = buf[end+3:]
+				self.packets.append(packet)
+				reply = self.handler(packet).encode('latin-1')
+				sock.sendall(b'$%s#%02x' % (reply, sum(reply) % 256))
+
+	def connect(self):
+		conn = rsp.RspConnection(self.sock)
+		conn.acks = False
+		return conn
+
+# a gdb-like adapter talking to a FakeStub
+def fake_gdblike(handler):
+	stub = FakeStub(handler)
+	adapter = gdblike.DebugAdapterGdbLike()
+	adapter.conn = stub.connect()
+	return (adapter, stub)
+
 def test_prologue(prog, testtype):
 	fpath = test_prog_to_fpath(prog)
 
@@ -149,7 +194,7 @@ def test_prologue(prog, testtype):
 	print('(file) entry offset: 0x%X' % entry_offs)
 
 	print('launching')
-	adapter = DebugAdapter.get_adapter_for_current_system()
+	adapter = DebugAdapter.get_adapter_for_current_system(**adapter_kwargs)
 	adapter.exec(fpath, '')
 
 	# learn load address, entrypoint
@@ -178,13 +223,27 @@ def test_prologue(prog, testtype):
 #------------------------------------------------------------------------------
 
 if __name__ == '__main__':
+	# linux: trace natively instead of through gdbserver
+	if '--ptrace' in sys.argv:
+		sys.argv.remove('--ptrace')
+		adapter_kwargs['ptrace'] = True
+	# linux: reach gdbserver over 'tcp' (default), or its stdin/stdout as a
+	# 'unix' domain socket pair or a 'pipe', eg: --transport=pipe
+	for option in [a for a in sys.argv if a.startswith('--transport=')]:
+		sys.argv.remove(option)
+		adapter_kwargs['transport'] = option[12:]
+	# linux: gdbserver's inferior memory through /proc/<pid>/mem, not RSP
+	if '--local-mem' in sys.argv:
+		sys.argv.remove('--local-mem')
+		adapter_kwargs['local_mem'] = True
+
 	arg = sys.argv[1] if sys.argv[1:] else None
 
 	# one-off tests
 	if arg == 'oneoff':
 		fpath = test_prog_to_fpath('helloworld_thread')
-		adapter = DebugAdapter.get_adapter_for_current_system()
-		adapter.exec(fpath)
+		adapter = DebugAdapter.get_adapter_for_current_system(**adapter_kwargs)
+		adapter.exec(fpath, '')
 		print(adapter.mem_modules())
 		print(type(adapter) == dbgeng.DebugAdapterDbgeng)
 		sys.exit(0)
@@ -196,8 +255,377 @@ if __name__ == '__main__':
 		tests = ['thread']
 	elif arg in ['basic']:
 		tests = ['basic']
+	elif arg in ['cache', 'memcache']:
+		tests = ['cache']
+	elif arg in ['agentexpr', 'condition', 'conditions']:
+		tests = ['agentexpr']
+	elif arg in ['rsp']:
+		tests = ['rsp']
+	elif arg in ['gdblike']:
+		tests = ['gdblike']
 	else:
-		tests = ['assembly', 'thread', 'basic']
+		tests = ['agentexpr', 'rsp', 'gdblike', 'cache', 'assembly', 'thread', 'basic']
+
+	if 'agentexpr' in tests:
+		print('----------------------------------------------------------------')
+		print('AGENTEXPR test')
+		print('----------------------------------------------------------------')
+
+		regs = {'rax':0, 'rbx':1, 'rcx':2, 'rsp':7}
+		values = {0:5, 1:0, 2:0xFFFFFFFFFFFFFFFF, 7:0x100}
+		mem = bytearray(0x200)
+		mem[0x108:0x110] = b'\xEF\xBE\xAD\xDE\x00\x00\x00\x00'
+		def evaluate(text):
+			code = agentexpr.compile_expr(text, regs)
+			return agentexpr.evaluate(code, lambda rid: values[rid], lambda addr, length: bytes(mem[addr:addr+length]))
+
+		print('compiled bytecode')
+		assert agentexpr.compile_expr('rax == 5', regs).hex() == '26000022051327'
+		assert agentexpr.compile_expr('rax == 3 and rbx', regs).hex() == '2600002203130e0e280e200013292600010e0e27'
+		assert agentexpr.compile_expr('u32(rsp+8)', regs).hex() == '2600072208021927'
+		assert agentexpr.compile_expr('-1', regs).hex() == '220022010327'
+
+		print('comparisons (unsigned)')
+		assert evaluate('rax == 5') == 1 and evaluate('rax != 5') == 0
+		assert evaluate('rax < 6') == 1 and evaluate('rax > 6') == 0
+		assert evaluate('rax <= 5') == 1 and evaluate('rax >= 6') == 0
+		assert evaluate('rcx > rax') == 1
+
+		print('and, or, not')
+		assert evaluate('rax == 5 and rbx') == 0
+		assert evaluate('rax == 5 or rbx') == 1
+		assert evaluate('rbx or rax') == 1
+		assert evaluate('rbx and rcx') == 0
+		assert evaluate('rax and rcx and rsp') == 1
+		assert evaluate('not rbx') == 1 and evaluate('not rax') == 0
+
+		print('negative literals and arithmetic wrap at 64 bits')
+		assert evaluate('rcx == -1') == 1
+		assert evaluate('rax - 6 == -1') == 1
+		assert evaluate('-rax == 0xFFFFFFFFFFFFFFFB') == 1
+		assert evaluate('~rbx == -1') == 1
+		assert evaluate('(rax << 2) | 1 == 21') == 1
+		assert evaluate('rax // 2 == 2 and rax % 2 == 1') == 1
+
+		print('memory derefs')
+		assert evaluate('u32(rsp+8) == 0xDEADBEEF') == 1
+		assert evaluate('u8(rsp+8)') == 0xEF
+		assert evaluate('u16(rsp+8) + 1') == 0xBEF0
+		assert evaluate('u64(rsp+8) == u32(rsp+8)') == 1
+
+		print('unsupported conditions are errors')
+		for text in ['rdx == 1', 'rax < rbx < rcx', 'rax ==', 'f(rax)', 'u32(rax, 4)', 'rax / 2']:
+			try:
+				agentexpr.compile_expr(text, regs)
+				assert False, text
+			except DebugAdapter.GeneralError:
+				pass
+
+	if 'rsp' in tests:
+		print('----------------------------------------------------------------')
+		print('RSP test')
+		print('----------------------------------------------------------------')
+
+		print('run length decoding')
+		assert rsp.un_rle('0123') == '0123'
+		assert rsp.un_rle('0* ') == '0000'
+		assert rsp.un_rle(b'x*"y') == b'xxxxxxy'
+		assert rsp.un_rle('ab*!c*"') == 'abbbbbcccccc'
+		# '*' as the count is 13 more, the next '*' starts a run again
+		assert rsp.un_rle('a**b') == 'a'*14 + 'b'
+		assert rsp.un_rle('a**b*!') == 'a'*14 + 'b'*5
+		assert rsp.un_rle(bytearray(b'0* 1')) == b'00001'
+
+		print('binary escaping')
+		assert rsp.binary_encode(b'a}#$*b') == b'a}\x5d}\x03}\x04}\x0ab'
+		assert rsp.binary_encode(b'}]') == b'}\x5d]'
+		assert rsp.binary_decode(b'a}\x5d}\x03}\x04}\x0ab') == b'a}#$*b'
+		assert rsp.binary_decode(b'0* }\x5d') == b'0000}'
+		every = bytes(range(256)) * 2
+		assert rsp.binary_decode(rsp.binary_encode(every)) == every
+
+		print('qSupported replies')
+		features = rsp.packet_qSupported_to_dict('PacketSize=3fff;QStartNoAckMode+;qXfer:auxv:read-;vContSupported?;;name=a=b')
+		assert features == {'PacketSize': 0x3fff, 'QStartNoAckMode': True, 'qXfer:auxv:read': False, 'vContSupported': None, 'name': 'a=b'}
+		assert rsp.packet_qSupported_to_dict('') == {}
+		try:
+			rsp.packet_qSupported_to_dict('multiprocess')
+			assert False
+		except rsp.RspGeneralError:
+			pass
+
+		print('qXfer reads in chunks')
+		obj = b'<target>}#$*' + bytes(range(256)) + b'</target>'
+		def handler(packet):
+			m = re.match(r'^qXfer:features:read:target.xml:(\w+),(\w+)$', packet)
+			if not m:
+				return 'E01'
+			(offset, length) = (int(m.group(1), 16), int(m.group(2), 16))
+			chunk = obj[offset:offset+length]
+			prefix = 'l' if offset+length >= len(obj) else 'm'
+			return prefix + rsp.binary_encode(chunk).decode('latin-1')
+		stub = FakeStub(handler)
+		conn = stub.connect()
+		assert b''.join(rsp.qxfer_read(conn, 'features', 'target.xml', 0x40)) == obj
+		assert stub.packets == ['qXfer:features:read:target.xml:%x,40' % offset for offset in range(0, len(obj), 0x40)]
+		assert list(rsp.qxfer_read(conn, 'features', 'target.xml', 0x1000)) == [obj]
+		for (annex, reply) in [('missing.xml', 'E01'), ('target.xml', 'm')]:
+			stub.handler = lambda packet: reply
+			try:
+				list(rsp.qxfer_read(conn, 'features', annex))
+				assert False
+			except rsp.RspGeneralError:
+				pass
+
+		print('replies a consumer didn\'t collect aren\'t taken for the next request\'s')
+		stub = FakeStub(lambda packet: 'reply to ' + packet)
+		conn = stub.connect()
+		replies = rsp.tx_rx_many(conn, ['m%x,1' % i for i in range(20)])
+		assert [next(replies) for i in range(3)] == ['reply to m0,1', 'reply to m1,1', 'reply to m2,1']
+		replies.close()
+		assert conn.pending == 0
+		assert rsp.tx_rx(conn, 'g') == 'reply to g'
+		replies = rsp.tx_rx_many(conn, ['m%x,1' % i for i in range(20)])
+		assert next(replies) == 'reply to m0,1'
+		assert rsp.tx_rx(conn, 'g') == 'reply to g'
+		assert list(rsp.tx_rx_many(conn, ['m0,1', 'm1,1'])) == ['reply to m0,1', 'reply to m1,1']
+
+		print('a reply broken off half way fails every later request')
+		stub = FakeStub(lambda packet: 'reply to ' + packet)
+		conn = stub.connect()
+		conn.buf += b'junk'
+		for func in [lambda: list(rsp.tx_rx_many(conn, ['m0,1'])), lambda: rsp.tx_rx(conn, 'g')]:
+			try:
+				func()
+				assert False
+			except (rsp.RspExpectedStartOfPacket, rsp.RspDisconnected):
+				pass
+		assert conn.desynced
+
+	if 'gdblike' in tests:
+		print('----------------------------------------------------------------')
+		print('GDBLIKE test')
+		print('----------------------------------------------------------------')
+
+		print('a malformed register cache entry is a miss, the stub is asked')
+		os.environ['XDG_CACHE_HOME'] = tempfile.mkdtemp()
+		xmltxt = '<target><feature><reg name="rax" bitsize="64"/><reg name="rip" bitsize="64"/></feature></target>'
+		def handler(packet):
+			if packet.startswith('qXfer:features:read:target.xml:'):
+				return 'l' + xmltxt
+			return ''
+		digest = hashlib.sha1(xmltxt.encode('utf-8')).hexdigest()
+		for reg_info in [{'rax': {'width': 64}}, {'rax': {'id': 0, 'width': '64'}}, ['rax'], None]:
+			(gdbadapter, stub) = fake_gdblike(handler)
+			gdblike.layout_cache_store(gdbadapter.stub_identity(), {'target.xml': digest, 'reg_info': reg_info})
+			gdbadapter.reg_info_load()
+			assert gdbadapter.reg_info['rip']['id'] == 1 and gdbadapter.reg_info['rip']['offset'] == 64
+			assert gdbadapter.reg_layout.decode('01' + '00'*7 + '02' + '00'*7) == {'rax': 1, 'rip': 2}
+		with open(gdblike.layout_cache_fpath(gdbadapter.stub_identity()), 'w') as fp:
+			fp.write('["not", "a", "dict"]')
+		(gdbadapter, stub) = fake_gdblike(handler)
+		gdbadapter.reg_info_load()
+		assert gdbadapter.reg_id_to_name == {0: 'rax', 1: 'rip'}
+		print('a good entry is used as is')
+		(gdbadapter, stub) = fake_gdblike(handler)
+		gdblike.layout_cache_store(gdbadapter.stub_identity(), {'target.xml': digest, 'reg_info': {'rax': {'id': 0, 'width': 64}}})
+		gdbadapter.reg_info_load()
+		assert list(gdbadapter.reg_info) == ['rax']
+		print('concurrent sessions never read a partly written entry')
+		identity = gdbadapter.stub_identity()
+		def writer():
+			for i in range(200):
+				gdblike.layout_cache_store(identity, {'target.xml': digest, 'reg_info': {'r%d' % i: {'id': 0, 'width': 64}}})
+		writers = [threading.Thread(target=writer) for i in range(4)]
+		for thread in writers:
+			thread.start()
+		while [thread for thread in writers if thread.is_alive()]:
+			assert gdblike.layout_cache_load(identity)['target.xml'] == digest
+		for thread in writers:
+			thread.join()
+		assert os.listdir(os.path.dirname(gdblike.layout_cache_fpath(identity))) == [os.path.basename(gdblike.layout_cache_fpath(identity))]
+
+		print('stop packets name the thread and expedite registers')
+		def handler(packet):
+			if packet.startswith('vCont;c'):
+				return 'T05thread:2a;10:3011400000000000;07:00e0ffffff7f0000;'
+			return ''
+		(gdbadapter, stub) = fake_gdblike(handler)
+		gdbadapter.reg_info = {'rsp': {'id': 7, 'width': 64}, 'rip': {'id': 16, 'width': 64}}
+		gdbadapter.reg_info_finish()
+		gdbadapter.os_sig_to_reason = {5: DebugAdapter.STOP_REASON.SIGNAL_TRAP}
+		assert gdbadapter.go() == (DebugAdapter.STOP_REASON.SIGNAL_TRAP, 5)
+		assert gdbadapter.tid == 0x2a
+		assert gdbadapter.reg_cache == {'rip': 0x401130, 'rsp': 0x7fffffffe000}
+		assert gdbadapter.reg_read('rip') == 0x401130
+		# no '?' for the thread, no 'g' for the registers
+		assert stub.packets == ['vCont;c:-1']
+
+		print('steps let the other threads run, except off a breakpoint')
+		def handler(packet):
+			if packet.startswith('Z0'):
+				return 'OK'
+			if packet.startswith('vCont;s'):
+				return 'T05thread:2a;10:%016x;' % int.from_bytes((0x401131).to_bytes(8, 'big'), 'little')
+			return ''
+		stub.handler = handler
+		gdbadapter.breakpoint_set(0x401130)
+		gdbadapter.step_into()
+		assert gdbadapter.reg_read('rip') == 0x401131
+		gdbadapter.step_into()
+		assert stub.packets[-3:] == ['Z0,401130,1', 'vCont;s:2a', 'vCont;s:2a;c']
+
+		print('register writes wrap at the register\'s width')
+		def handler(packet):
+			if packet == 'g':
+				return '11'*8 + '22'*4
+			return 'OK' if packet.startswith('G') else ''
+		(gdbadapter, stub) = fake_gdblike(handler)
+		gdbadapter.reg_info = {'rax': {'id': 0, 'width': 64, 'offset': 0}, 'eflags': {'id': 1, 'width': 32, 'offset': 64}}
+		gdbadapter.reg_info_finish()
+		gdbadapter.reg_write('rax', -1)
+		gdbadapter.reg_write('eflags', 0x100000246)
+		assert stub.packets == ['P0=FFFFFFFFFFFFFFFF', 'g', 'G' + 'FF'*8 + '22'*4, 'P1=46020000', 'g', 'G' + '11'*8 + '46020000']
+
+	if 'cache' in tests:
+		print('----------------------------------------------------------------')
+		print('CACHE test')
+		print('----------------------------------------------------------------')
+
+		# counts reads and bytes transferred, pages 0x10 and up are unmapped
+		class CountingAdapter:
+			def __init__(self):
+				self.mem = bytes([i & 0xFF for i in range(0x10 * memcache.PAGE_SIZE)])
+				(self.reads, self.transferred, self.compares) = (0, 0, 0)
+			def mem_read(self, address, length):
+				self.reads += 1
+				if address + length > len(self.mem):
+					raise DebugAdapter.GeneralError('reading from address 0x%X' % address)
+				self.transferred += length
+				return self.mem[address:address+length]
+			def mem_compare(self, address, data):
+				self.compares += 1
+				return self.mem[address:address+len(data)] == data
+
+		PAGE = memcache.PAGE_SIZE
+		adapter = CountingAdapter()
+		cache = memcache.PageCache()
+
+		print('large read is one adapter read of the pages it covers')
+		assert cache.read(adapter, 0x10, 8*PAGE) == adapter.mem[0x10:0x10+8*PAGE]
+		assert (adapter.reads, adapter.transferred) == (1, 9*PAGE)
+
+		print('cached reads transfer nothing')
+		assert cache.read(adapter, 0x123, 0x2000) == adapter.mem[0x123:0x2123]
+		assert cache.read(adapter, 8*PAGE, 0x10) == adapter.mem[8*PAGE:8*PAGE+0x10]
+		assert (adapter.reads, adapter.transferred) == (1, 9*PAGE)
+
+		print('gaps around cached pages are read once each')
+		cache.clear()
+		cache.read(adapter, 2*PAGE, 1)
+		cache.read(adapter, 5*PAGE, 1)
+		(adapter.reads, adapter.transferred) = (0, 0)
+		assert cache.read(adapter, 0, 8*PAGE) == adapter.mem[0:8*PAGE]
+		assert (adapter.reads, adapter.transferred) == (3, 6*PAGE)
+
+		print('unmapped pages fail, mapped neighbors stay cached')
+		cache.clear()
+		(adapter.reads, adapter.transferred) = (0, 0)
+		assert cache.read(adapter, 0xE*PAGE, 4*PAGE) == None
+		assert (adapter.reads, adapter.transferred) == (4, 2*PAGE)
+		assert cache.read(adapter, 0x10*PAGE, 1) == None
+		assert cache.read(adapter, 0xE*PAGE, 2*PAGE) == adapter.mem[0xE*PAGE:]
+		assert (adapter.reads, adapter.transferred) == (4, 2*PAGE)
+
+		print('least recently used pages are dropped beyond the cap')
+		cache = memcache.PageCache(pages_max=4)
+		assert cache.read(adapter, 0, 8*PAGE) == adapter.mem[0:8*PAGE]
+		assert sorted(cache.pages) == [4, 5, 6, 7]
+		cache.read(adapter, 4*PAGE, 1)
+		cache.read(adapter, 0, 1)
+		assert list(cache.pages) == [6, 7, 4, 0]
+
+		print('stops keep only pages inside read-only mappings, once compared')
+		cache = memcache.PageCache()
+		cache.set_regions([(0, 2*PAGE, 'rx'), (2*PAGE, 4*PAGE, 'rw'), (4*PAGE, 5*PAGE, 'r'), (5*PAGE, 6*PAGE, 'rw')])
+		cache.read(adapter, 0, 6*PAGE)
+		cache.invalidate(adapter.mem_compare)
+		assert sorted(cache.pages) == [0, 1, 4]
+		assert adapter.compares == 2
+		(adapter.reads, adapter.transferred) = (0, 0)
+		assert cache.read(adapter, 0, 6*PAGE) == adapter.mem[0:6*PAGE]
+		assert (adapter.reads, adapter.transferred) == (2, 3*PAGE)
+
+		print('kept pages the target changed under a stale map are dropped')
+		# eg: mprotect()ed writable and patched, or remapped
+		adapter.mem = bytearray(adapter.mem)
+		adapter.mem[4*PAGE+1] ^= 0xFF
+		cache.invalidate(adapter.mem_compare)
+		assert sorted(cache.pages) == [0, 1]
+		assert cache.read(adapter, 4*PAGE, 4) == adapter.mem[4*PAGE:4*PAGE+4]
+		adapter.mem[4*PAGE+1] ^= 0xFF
+		cache.invalidate()
+		assert sorted(cache.pages) == []
+
+		print('gdb-like adapters compare by the stub\'s checksum')
+		def handler(packet):
+			if packet.startswith('qCRC:'):
+				(address, length) = [int(x, 16) for x in packet[5:].split(',')]
+				return 'C%x' % rsp.crc32(adapter.mem[address:address+length])
+			return ''
+		(gdbadapter, stub) = fake_gdblike(handler)
+		assert rsp.crc32(b'123456789') == 0x0376E6E7
+		assert gdbadapter.mem_compare(PAGE, adapter.mem[PAGE:3*PAGE])
+		assert not gdbadapter.mem_compare(PAGE, b'\xFF' + adapter.mem[PAGE+1:3*PAGE])
+		assert stub.packets == ['qCRC:1000,2000', 'qCRC:1000,2000']
+		(gdbadapter, stub) = fake_gdblike(lambda packet: '')
+		cache.read(adapter, 0, 6*PAGE)
+		cache.invalidate(gdbadapter.mem_compare)
+		cache.invalidate(gdbadapter.mem_compare)
+		assert sorted(cache.pages) == [] and stub.packets == ['qCRC:0,2000']
+		cache.read(adapter, 0, 6*PAGE)
+
+		print('writes update cached pages in place')
+		(adapter.reads, adapter.transferred) = (0, 0)
+		patch = b'\xCC' * (PAGE + 0x20)
+		adapter.mem[PAGE-0x10:2*PAGE+0x10] = patch
+		cache.write(PAGE-0x10, patch)
+		assert cache.read(adapter, 0, 3*PAGE) == adapter.mem[0:3*PAGE]
+		assert (adapter.reads, adapter.transferred) == (0, 0)
+		cache.drop(PAGE-1, 2)
+		assert sorted(cache.pages) == [2, 3, 4, 5]
+
+		print('writes through a gdb-like adapter keep the page cached')
+		def handler(packet):
+			if packet.startswith('M'):
+				(header, data) = packet[1:].split(':')
+				address = int(header.split(',')[0], 16)
+				if address >= 3*PAGE:
+					return 'E01'
+				data = bytes.fromhex(data)
+				adapter.mem[address:address+len(data)] = data
+				return 'OK'
+			return ''
+		(gdbadapter, stub) = fake_gdblike(handler)
+		gdbadapter.mem_read = adapter.mem_read
+		assert cache.write_through(gdbadapter, 2*PAGE+0x22, b'\x90\x90\xC3') == 3
+		assert stub.packets == ['M2022,3:9090C3']
+		assert 2 in cache.pages
+		(adapter.reads, adapter.transferred) = (0, 0)
+		assert cache.read(adapter, 2*PAGE+0x20, 6) == b'\x20\x21\x90\x90\xC3\x25'
+		assert (adapter.reads, adapter.transferred) == (0, 0)
+		print('failed writes drop the pages they touched')
+		assert 3 in cache.pages
+		assert cache.write_through(gdbadapter, 3*PAGE+4, b'\xCC') == 0
+		assert not 3 in cache.pages and 2 in cache.pages
+
+		print('reads outside the memory map fail without asking the target')
+		(adapter.reads, adapter.transferred) = (0, 0)
+		assert cache.is_mapped(0, 6*PAGE) and not cache.is_mapped(6*PAGE-1, 2)
+		assert cache.read(adapter, 6*PAGE-0x10, 0x20) == None
+		assert cache.read(adapter, 6*PAGE, 1) == None
+		assert (adapter.reads, adapter.transferred) == (0, 0)
+		assert cache.read(adapter, 5*PAGE+0x700, 0x10) == adapter.mem[5*PAGE+0x700:5*PAGE+0x710]
 
 	if 'assembly' in tests:
 		(adapter, entry) = test_prologue('asmtest', 'ASSEMBLY')
@@ -329,6 +757,11 @@ if __name__ == '__main__':
 			adapter.mem_write(addr, data)
 			assert adapter.mem_read(addr, 256) == data
 
+			print('mem read spanning a breakpoint shows the original byte')
+			adapter.breakpoint_set(addr+4)
+			assert adapter.mem_read(addr, 16) == data[0:16]
+			adapter.breakpoint_clear(addr+4)
+
 			print('quiting')
 			adapter.quit()
 			adapter = None
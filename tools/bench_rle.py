@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+#
+# micro-benchmark rsp.un_rle against the old character-at-a-time decoder
+#
+# usage:
+# ./bench_rle.py
+
+import sys
+import random
+import timeit
+
+sys.path.append('.')
+sys.path.append('..')
+import rsp
+
+# the decoder as it was, appending to a str one character at a time
+def un_rle_old(data):
+	if not '*' in data:
+		return data
+
+	skip = 0
+	result = ''
+	for (i,char) in enumerate(data):
+		if skip:
+			skip = False
+		elif char == '*':
+			repeat = ord(data[i+1])-29
+			result = result + result[-1]*repeat
+			skip = True
+		else:
+			result += char
+
+	return result
+
+# run length encode like a stub: repeats of up to 97, never 6 or 7 ('#', '$')
+def rle(data):
+	result = ''
+	i = 0
+	while i < len(data):
+		char = data[i]
+		n = 1
+		while i+n < len(data) and data[i+n] == char and n < 98:
+			n += 1
+		repeat = n-1
+		if repeat in [6, 7]:
+			repeat = 5
+		if repeat >= 3:
+			result += char + '*' + chr(repeat+29)
+			i += repeat+1
+		else:
+			result += char
+			i += 1
+	return result
+
+# amd64 'g' reply: a few live gprs, zeroed x87/sse/avx state
+def reply_g():
+	gprs = ''.join(['%016x' % x for x in [0x1c, 0, 0x7ffff7dd, 0x7fffffffe3d8]])
+	gprs += '00' * 8 * 13
+	segs = '33000000' + '2b000000' + '00000000' * 4
+	x87 = '00' * 10 * 8 + '7f030000' + '00000000' * 7
+	sse = '00' * 16 * 16 + '801f0000'
+	avx = '00' * 16 * 16
+	return rle(gprs + segs + x87 + sse + avx)
+
+# 'm' reply of a 16KB heap region: a quarter of each 256 byte chunk in use,
+# the rest zero
+def reply_m():
+	rand = random.Random(0)
+	data = bytearray(0x4000)
+	for i in range(0, len(data), 0x100):
+		data[i:i+0x40] = bytes([rand.randrange(256) for j in range(0x40)])
+	return rle(data.hex())
+
+if __name__ == '__main__':
+	for (name, reply) in [('g', reply_g()), ('m', reply_m())]:
+		expanded = un_rle_old(reply)
+		assert rsp.un_rle(reply) == expanded
+		assert rsp.un_rle(reply.encode('utf-8')) == expanded.encode('utf-8')
+
+		number = 200
+		t_old = timeit.timeit(lambda: un_rle_old(reply), number=number) / number
+		t_new = timeit.timeit(lambda: rsp.un_rle(reply), number=number) / number
+		t_bytes = timeit.timeit(lambda: rsp.un_rle(reply.encode('utf-8')), number=number) / number
+
+		print('%s reply: %d chars encoded, %d decoded' % (name, len(reply), len(expanded)))
+		print('  old:         %10.1f us' % (t_old * 1000000))
+		print('  new (str):   %10.1f us (%.1fx)' % (t_new * 1000000, t_old/t_new))
+		print('  new (bytes): %10.1f us (%.1fx)' % (t_bytes * 1000000, t_old/t_bytes))
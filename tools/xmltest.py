@@ -11,10 +11,8 @@ import rsp
 
 def get_xml(sock, fname):
 	print('downloading %s' % fname)
-	data = rsp.tx_rx(sock, 'qXfer:features:read:%s:0,fff' % fname, 'ack_then_reply')
-	assert data[0] == 'l'
-	data = rsp.un_rle(data[1:])
-	return data
+	data = b''.join(rsp.qxfer_read(sock, 'features', fname))
+	return data.decode('utf-8')
 
 def download_xml(sock, fname):
 	with open(fname, 'w') as fp:
@@ -84,6 +82,7 @@ if __name__ == '__main__':
 
 	sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 	sock.connect(('localhost', port))
+	sock = rsp.RspConnection(sock)
 	reply = rsp.tx_rx(sock, 'Hgp0.0')
 	parse_target_xml(sock)
 	sock.close()
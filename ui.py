@@ -142,6 +142,7 @@ class DebuggerUI:
 
 		self.state.update_highlights()
 		self.state.last_rip = local_rip
+		self.update_breakpoints()
 
 		# select instruction currently at
 		if self.state.bv.read(local_rip, 1):
@@ -236,7 +237,8 @@ class DebuggerUI:
 				if local_bp in self.state.breakpoints.keys():
 					bps.append({
 						'enabled': self.state.breakpoints[local_bp],
-						'address': local_bp
+						'address': local_bp,
+						'hits': self.state.breakpoint_hits.get(local_bp, 0)
 					})
 
 		bp_widget = self.widget("Breakpoints")